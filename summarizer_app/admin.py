@@ -1,3 +1,11 @@
 from django.contrib import admin
 
+from .models import VideoSummary
+
 # Register your models here.
+
+
+@admin.register(VideoSummary)
+class VideoSummaryAdmin(admin.ModelAdmin):
+    list_display = ('video_id', 'title', 'updated_at')
+    search_fields = ('video_id', 'title')
@@ -0,0 +1,138 @@
+import io
+import threading
+
+from django.conf import settings
+
+
+class MemoryBudget:
+    """
+    プロセス全体でメモリ上に保持する音声チャンクの合計バイト数の上限。
+    上限に達している間は新しいチャンクの作成を待たせる (バックプレッシャー)。
+    """
+
+    def __init__(self, capacity_bytes):
+        self.capacity_bytes = capacity_bytes
+        self._used_bytes = 0
+        self._condition = threading.Condition()
+
+    @property
+    def used_bytes(self):
+        with self._condition:
+            return self._used_bytes
+
+    def acquire(self, num_bytes):
+        """
+        num_bytes 分の空きができるまで待って確保する。
+        上限より大きい要求は永久に待たないよう上限まで切り詰め、実際に確保したバイト数を返す。
+        """
+        num_bytes = min(num_bytes, self.capacity_bytes)
+        with self._condition:
+            while self._used_bytes + num_bytes > self.capacity_bytes:
+                self._condition.wait()
+            self._used_bytes += num_bytes
+        return num_bytes
+
+    def force_acquire(self, num_bytes):
+        """
+        待たずに確保する (上限を一時的に超えることを許す)。
+        既に確保済みのチャンクが見積もりより大きかった場合に使い、確保中同士での待ち合い (デッドロック) を避ける。
+        """
+        with self._condition:
+            self._used_bytes += num_bytes
+        return num_bytes
+
+    def release(self, num_bytes):
+        with self._condition:
+            self._used_bytes -= num_bytes
+            self._condition.notify_all()
+
+
+class ChunkBuffer:
+    """
+    メモリ上に保持する1つの音声チャンク。MemoryBudget から確保した分は release() で返却する。
+    """
+
+    def __init__(self, budget, estimated_bytes):
+        self._budget = budget
+        self._reserved_bytes = budget.acquire(estimated_bytes)
+        self._data = bytearray(self._reserved_bytes)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def fill_from(self, stream):
+        """
+        ストリーム (ffmpeg の標準出力など) を終端まで読み込む。見積もりを超えた分は追加で確保する。
+        """
+        while True:
+            if self._length == len(self._data):
+                extra_bytes = max(len(self._data) // 2, 64 * 1024)
+                self._reserved_bytes += self._budget.force_acquire(extra_bytes)
+                self._data.extend(bytes(extra_bytes))
+            with memoryview(self._data) as view, view[self._length:] as target:
+                read_bytes = stream.readinto(target)
+            if not read_bytes:
+                return
+            self._length += read_bytes
+
+    def open(self):
+        """
+        チャンクの内容をコピーせずに読み出すファイルオブジェクトを返す (アップロード用)
+        """
+        return _MemoryviewReader(memoryview(self._data)[:self._length])
+
+    def release(self):
+        if self._data is None:
+            return
+        self._data = None
+        self._budget.release(self._reserved_bytes)
+        self._reserved_bytes = 0
+
+
+class _MemoryviewReader(io.RawIOBase):
+    """
+    memoryview を読み出し専用・シーク可能なファイルとして扱うためのラッパー
+    """
+
+    def __init__(self, view):
+        self._view = view
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        read_bytes = min(len(buffer), len(self._view) - self._position)
+        if read_bytes <= 0:
+            return 0
+        buffer[:read_bytes] = self._view[self._position:self._position + read_bytes]
+        self._position += read_bytes
+        return read_bytes
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = len(self._view) + offset
+        else:
+            raise ValueError(f"invalid whence: {whence}")
+        self._position = max(self._position, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+        super().close()
+
+
+# --- 共有のメモリ予算 ---
+chunk_memory_budget = MemoryBudget(settings.TRANSCRIPTION_MEMORY_BUDGET_BYTES)
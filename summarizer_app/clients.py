@@ -0,0 +1,143 @@
+import threading
+import traceback
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# openai / googleapiclient はインポート自体が重い (合わせて0.5秒以上) ため、
+# ワーカー起動を速くするために最初に使われるタイミングまでインポートを遅延させる。
+
+
+# --- OpenAI API Client ---
+# OpenAI クライアント (内部の httpx.Client) はスレッドセーフなので、プロセス内で1つを共有し
+# keep-alive 接続を使い回す。接続エラーが続いた場合は作り直す。
+_openai_lock = threading.Lock()
+_openai_client = None
+_openai_consecutive_failures = 0
+
+
+def get_openai_client():
+    """
+    共有の OpenAI クライアントを返す。初回呼び出し時 (または不調で破棄された後) に作成する。
+    作成に失敗した場合は None を返し、次回の呼び出しで再度作成を試みる。
+    """
+    global _openai_client
+    client = _openai_client
+    if client is not None:
+        return client
+
+    with _openai_lock:
+        if _openai_client is None:
+            _openai_client = _create_openai_client()
+        return _openai_client
+
+
+def report_openai_success():
+    """
+    OpenAI API 呼び出しの成功を記録し、連続失敗回数をリセットする
+    """
+    global _openai_consecutive_failures
+    if _openai_consecutive_failures:
+        with _openai_lock:
+            _openai_consecutive_failures = 0
+
+
+def report_openai_failure(exc):
+    """
+    OpenAI API 呼び出しの失敗を記録する。接続レベルのエラーが
+    settings.OPENAI_CLIENT_MAX_CONSECUTIVE_FAILURES 回続いた場合はクライアントを破棄し、次回作り直す。
+    API がエラーレスポンスを返した場合 (レート制限など) は接続自体は正常なので数えない。
+    """
+    global _openai_client, _openai_consecutive_failures
+    import openai
+
+    if not isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError)):
+        return
+
+    with _openai_lock:
+        _openai_consecutive_failures += 1
+        if _openai_consecutive_failures < settings.OPENAI_CLIENT_MAX_CONSECUTIVE_FAILURES:
+            return
+        print(f"警告: OpenAI API への接続エラーが {_openai_consecutive_failures} 回続いたため、クライアントを作り直します。")
+        # 他のスレッドが使用中の可能性があるため、close() せずに参照を外すだけにする (GCで解放される)
+        _openai_client = None
+        _openai_consecutive_failures = 0
+
+
+def _create_openai_client():
+    try:
+        import httpx
+        from openai import OpenAI
+
+        print("OpenAI API クライアントを初期化中...")
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=settings.OPENAI_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.OPENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.OPENAI_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            timeout=httpx.Timeout(settings.OPENAI_HTTP_TIMEOUT_SECONDS, connect=10.0),
+        )
+        client = OpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL, http_client=http_client)
+        print("OpenAI API クライアントの初期化に成功しました。")
+        return client
+    except Exception as e:
+        print(f"OpenAI API クライアントの初期化に失敗しました: {e}")
+        print(f"トレースバック:\n{traceback.format_exc()}")
+        return None
+
+
+# --- YouTube Data API Client ---
+# googleapiclient のリソースが使う httplib2.Http はスレッドセーフではないため、
+# クライアントをプールしてスレッドごとに貸し出す。各クライアントは自身の keep-alive 接続を保持する。
+_youtube_lock = threading.Lock()
+_youtube_idle_clients = []
+
+
+@contextmanager
+def youtube_client():
+    """
+    プールから YouTube Data API クライアントを借りる。
+    通信レベルのエラーが発生したクライアントはプールに戻さずに破棄する。
+
+    使用例:
+        with youtube_client() as youtube:
+            youtube.videos().list(...).execute()
+    """
+    from googleapiclient.errors import HttpError
+
+    with _youtube_lock:
+        client = _youtube_idle_clients.pop() if _youtube_idle_clients else None
+    if client is None:
+        client = _create_youtube_client()
+
+    healthy = True
+    try:
+        yield client
+    except HttpError:
+        # API がエラーレスポンスを返しただけで、接続は正常
+        raise
+    except Exception:
+        healthy = False
+        raise
+    finally:
+        if healthy:
+            with _youtube_lock:
+                if len(_youtube_idle_clients) < settings.YOUTUBE_CLIENT_POOL_SIZE:
+                    _youtube_idle_clients.append(client)
+
+
+def _create_youtube_client():
+    import httplib2
+    from googleapiclient.discovery import build
+
+    # static_discovery=True: ライブラリ同梱のディスカバリードキュメントを使い、起動時の通信を避ける
+    client_options = {'api_endpoint': settings.YOUTUBE_API_ENDPOINT} if settings.YOUTUBE_API_ENDPOINT else None
+    return build(
+        'youtube', 'v3',
+        developerKey=settings.YOUTUBE_API_KEY,
+        http=httplib2.Http(timeout=settings.YOUTUBE_HTTP_TIMEOUT_SECONDS),
+        cache_discovery=False,
+        static_discovery=True,
+        client_options=client_options,
+    )
@@ -0,0 +1,54 @@
+"""
+負荷試験用の yt-dlp の代替。YT_DLP_COMMAND="python -m summarizer_app.loadtest.fake_yt_dlp" のように指定して使う。
+動画IDに埋め込まれた長さの音声 (無音に近いサイン波) を ffmpeg で作成して -o のパスにコピーする。
+同じ長さの音声は STANDIN_AUDIO_CACHE_DIR にキャッシュして使い回す。
+
+環境変数:
+    STANDIN_YT_DLP_LATENCY_MS: ダウンロードにかかる時間 (ミリ秒)
+    STANDIN_YT_DLP_ERROR_RATE: 失敗 (終了コード1) する確率
+"""
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from summarizer_app.loadtest.standins import duration_for_video_id
+
+
+def main(argv):
+    output_path = argv[argv.index('-o') + 1]
+    link = next((arg for arg in argv if 'youtu' in arg), '')
+    match = re.search(r'(?:v=|youtu\.be/)([a-zA-Z0-9_-]{11})', link)
+    duration_seconds = duration_for_video_id(match.group(1) if match else None)
+
+    latency_ms = float(os.environ.get('STANDIN_YT_DLP_LATENCY_MS', 0))
+    if latency_ms > 0:
+        time.sleep(latency_ms / 1000)
+    if random.random() < float(os.environ.get('STANDIN_YT_DLP_ERROR_RATE', 0)):
+        sys.stderr.write("ERROR: injected download error\n")
+        return 1
+
+    cache_dir = os.environ.get('STANDIN_AUDIO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'standin_audio'))
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_path = os.path.join(cache_dir, f"{duration_seconds}.mp3")
+    if not os.path.exists(cached_path):
+        # 並行して同じ長さの音声を作成しても壊れたファイルを読まないよう、別名で作成してからリネームする
+        partial_path = f"{cached_path}.{os.getpid()}.partial.mp3"
+        subprocess.run([
+            'ffmpeg', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration_seconds}',
+            '-ac', '1', '-ar', '16000', '-c:a', 'libmp3lame', '-b:a', '16k',
+            '-y', partial_path,
+        ], check=True)
+        os.replace(partial_path, cached_path)
+
+    shutil.copyfile(cached_path, output_path)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,248 @@
+import json
+import math
+import os
+import random
+import string
+import threading
+import time
+
+import httpx
+
+from .standins import make_video_id
+
+
+class ResourceSampler:
+    """
+    サーバープロセスの開いているファイル数・子プロセス数と、一時ディレクトリのディスク使用量を
+    一定間隔で計測してピーク値を記録する (Linux の /proc を使用)。
+    """
+
+    def __init__(self, pid=None, temp_dir=None, interval_seconds=0.2):
+        self.pid = pid
+        self.temp_dir = temp_dir
+        self.interval_seconds = interval_seconds
+        self.peaks = {"peak_open_files": None, "peak_child_processes": None, "peak_temp_disk_bytes": None}
+        self._initial_temp_disk_bytes = _directory_size(temp_dir) if temp_dir else 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peaks
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval_seconds)
+        self._sample()
+
+    def _sample(self):
+        if self.pid is not None:
+            self._record("peak_open_files", _open_file_count(self.pid))
+            self._record("peak_child_processes", _descendant_count(self.pid))
+        if self.temp_dir:
+            # 試験開始前から残っているファイルの分は除く
+            self._record("peak_temp_disk_bytes", max(_directory_size(self.temp_dir) - self._initial_temp_disk_bytes, 0))
+
+    def _record(self, key, value):
+        if value is None:
+            return
+        if self.peaks[key] is None or value > self.peaks[key]:
+            self.peaks[key] = value
+
+
+def api_key_for_user(user_index):
+    """
+    仮想ユーザーが X-API-Key ヘッダーで送るキー。サーバーの CLIENT_API_KEYS に登録すると、
+    ユーザーごとに別のクライアントとしてスケジューリングされる (未登録の場合は全員が同じIPのクライアントになる)
+    """
+    return f"loadtest-user-{user_index}"
+
+
+def run_load(target_url, users, requests_per_user, durations, timeout_seconds, seed=0):
+    """
+    users 人の仮想ユーザーが同時に、それぞれ requests_per_user 回ずつ要約APIを呼び出す。
+    動画の長さは durations から無作為に選ぶ。各リクエストの結果のリストと全体の所要時間を返す。
+    """
+    results = []
+    results_lock = threading.Lock()
+    start_barrier = threading.Barrier(users)
+
+    def virtual_user(user_index):
+        rng = random.Random(seed * 100003 + user_index)
+        # ユーザーごとに別のAPIキーを使い、サーバー側では別のクライアントとしてスケジューリングされるようにする
+        headers = {"X-API-Key": api_key_for_user(user_index)}
+        with httpx.Client(timeout=timeout_seconds, headers=headers) as client:
+            start_barrier.wait()
+            for _ in range(requests_per_user):
+                duration_seconds = rng.choice(durations)
+                suffix = "".join(rng.choices(string.ascii_letters + string.digits, k=4))
+                video_id = make_video_id(duration_seconds, suffix)
+                result = {"user": user_index, "video_id": video_id, "duration_seconds": duration_seconds}
+                started_at = time.perf_counter()
+                try:
+                    response = client.post(target_url, json={"link": f"https://www.youtube.com/watch?v={video_id}"})
+                    result["status"] = response.status_code
+                    result["ok"] = response.status_code == 200
+                except httpx.HTTPError as e:
+                    result["status"] = None
+                    result["ok"] = False
+                    result["error"] = f"{type(e).__name__}: {e}"
+                result["latency_seconds"] = time.perf_counter() - started_at
+                with results_lock:
+                    results.append(result)
+
+    threads = [threading.Thread(target=virtual_user, args=(i,), name=f"loadtest-user-{i}") for i in range(users)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started_at
+
+
+def build_report(results, wall_seconds, peaks):
+    """
+    リクエストごとの結果とリソースのピーク値から負荷試験のレポートを作成する
+    """
+    latencies = sorted(result["latency_seconds"] for result in results)
+    succeeded = sum(1 for result in results if result["ok"])
+    status_counts = {}
+    for result in results:
+        key = str(result["status"]) if result["status"] is not None else "connection_error"
+        status_counts[key] = status_counts.get(key, 0) + 1
+
+    report = {
+        "requests": len(results),
+        "succeeded": succeeded,
+        "errors": len(results) - succeeded,
+        "error_rate": (len(results) - succeeded) / len(results) if results else 0.0,
+        "throughput_rps": succeeded / wall_seconds if wall_seconds > 0 else 0.0,
+        "wall_seconds": wall_seconds,
+        "latency_seconds": {
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "status_counts": status_counts,
+    }
+    report.update(peaks)
+    return report
+
+
+# ベースラインと比較する指標: (レポート内のパス, 大きいほど悪いか, 悪化とみなす最小の差)
+# 開いているファイル数・子プロセス数などの小さい整数は、1つ増えただけで割合が大きく変わるため1の余裕を持たせる
+BASELINE_METRICS = [
+    (("throughput_rps",), False, 0),
+    (("latency_seconds", "p50"), True, 0),
+    (("latency_seconds", "p95"), True, 0),
+    (("latency_seconds", "p99"), True, 0),
+    (("peak_open_files",), True, 1),
+    (("peak_child_processes",), True, 1),
+    (("peak_temp_disk_bytes",), True, 0),
+]
+
+
+def compare_to_baseline(report, baseline, tolerance, error_rate_tolerance):
+    """
+    ベースラインより tolerance (割合) を超えて悪化した指標のメッセージのリストを返す。
+    エラー率は割合ではなく、error_rate_tolerance (絶対値) を超えて増えた場合に悪化とみなす。
+    """
+    regressions = []
+    for path, higher_is_worse, min_delta in BASELINE_METRICS:
+        current = _lookup(report, path)
+        expected = _lookup(baseline, path)
+        if current is None or expected is None:
+            continue
+        name = ".".join(path)
+        if higher_is_worse:
+            limit = expected * (1 + tolerance)
+            if current > limit and current - expected > min_delta:
+                regressions.append(f"{name}: {current:.3f} > ベースライン {expected:.3f} (許容上限 {limit:.3f})")
+        else:
+            limit = expected * (1 - tolerance)
+            if current < limit and expected - current > min_delta:
+                regressions.append(f"{name}: {current:.3f} < ベースライン {expected:.3f} (許容下限 {limit:.3f})")
+
+    if report["error_rate"] > baseline.get("error_rate", 0.0) + error_rate_tolerance:
+        regressions.append(
+            f"error_rate: {report['error_rate']:.3f} > ベースライン {baseline.get('error_rate', 0.0):.3f} + {error_rate_tolerance:.3f}"
+        )
+    return regressions
+
+
+def load_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def _percentile(sorted_values, percent):
+    # nearest-rank 法
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def _lookup(data, path):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def _open_file_count(pid):
+    try:
+        return len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return None
+
+
+def _descendant_count(pid):
+    children = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding='utf-8', errors='replace') as f:
+                stat = f.read()
+        except OSError:
+            continue # 計測中に終了したプロセス
+        # 2番目のフィールド (コマンド名) は空白や括弧を含みうるため、最後の ')' 以降を分割する
+        parent_pid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(parent_pid, []).append(int(entry))
+
+    count = 0
+    pending = [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            count += 1
+            pending.append(child)
+    return count
+
+
+def _directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue # 計測中に削除されたファイル
+    return total
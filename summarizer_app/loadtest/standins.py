@@ -0,0 +1,185 @@
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# 負荷試験用の動画IDは "lt" + 音声の長さ (秒, 5桁) + 任意の4文字 (例: lt00600a1b2 = 10分)。
+# 代替の YouTube Data API と yt-dlp はこの長さの動画として振る舞う
+LOADTEST_VIDEO_ID_PATTERN = re.compile(r'^lt(\d{5})[a-zA-Z0-9_-]{4}$')
+DEFAULT_DURATION_SECONDS = 300
+
+
+def make_video_id(duration_seconds, suffix):
+    return f"lt{duration_seconds:05d}{suffix}"
+
+
+def duration_for_video_id(video_id):
+    match = LOADTEST_VIDEO_ID_PATTERN.match(video_id or "")
+    return int(match.group(1)) if match else DEFAULT_DURATION_SECONDS
+
+
+@dataclass
+class ServiceBehavior:
+    """
+    代替サービスの応答の遅延 (ミリ秒) とエラーを返す確率
+    """
+    latency_ms: float = 0
+    jitter_ms: float = 0
+    error_rate: float = 0.0
+
+    def apply(self):
+        """
+        設定された遅延だけ待ち、エラーを返すべきなら True を返す
+        """
+        delay_ms = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+        return random.random() < self.error_rate
+
+
+class StandinServer(ThreadingHTTPServer):
+    """
+    YouTube Data API (/youtube/v3/videos) と OpenAI API (/v1/audio/transcriptions, /v1/chat/completions)
+    の代わりに応答するHTTPサーバー。サービスごとに遅延とエラーを注入できる。
+    """
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, youtube, whisper, chat):
+        super().__init__(address, _StandinHandler)
+        self.behaviors = {"youtube": youtube, "whisper": whisper, "chat": chat}
+        self.request_counts = {"youtube": 0, "whisper": 0, "chat": 0, "errors": 0}
+        self._counts_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, service, error):
+        with self._counts_lock:
+            self.request_counts[service] += 1
+            if error:
+                self.request_counts["errors"] += 1
+
+    def start_in_background(self):
+        thread = threading.Thread(target=self.serve_forever, name="loadtest-standins", daemon=True)
+        thread.start()
+        return thread
+
+
+class _StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive 接続を受け付ける
+
+    def log_message(self, format, *args):
+        pass # 負荷試験中のアクセスログは出さない
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/').endswith('/youtube/v3/videos'):
+            return self._videos(parse_qs(url.query))
+        self._send_json(404, {"error": {"message": f"not found: {url.path}"}})
+
+    def do_POST(self):
+        # アップロードされた音声などの本文は読み捨てる
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        path = urlparse(self.path).path.rstrip('/')
+        if path.endswith('/audio/transcriptions'):
+            return self._transcription()
+        if path.endswith('/chat/completions'):
+            return self._chat_completion()
+        self._send_json(404, {"error": {"message": f"not found: {path}"}})
+
+    def _videos(self, query):
+        failed = self.server.behaviors["youtube"].apply()
+        self.server.count("youtube", failed)
+        if failed:
+            return self._send_json(503, {"error": {"code": 503, "message": "injected error"}})
+
+        video_id = query.get('id', [''])[0]
+        duration_seconds = duration_for_video_id(video_id)
+        etag = f'"standin-{video_id}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send_json(200, {
+            "kind": "youtube#videoListResponse",
+            "etag": etag,
+            "items": [{
+                "kind": "youtube#video",
+                "id": video_id,
+                "snippet": {"title": f"負荷試験用の動画 {video_id}", "description": "stand-in"},
+                "contentDetails": {"duration": f"PT{duration_seconds}S"},
+            }],
+        }, headers={'ETag': etag})
+
+    def _transcription(self):
+        failed = self.server.behaviors["whisper"].apply()
+        self.server.count("whisper", failed)
+        if failed:
+            return self._send_json(500, {"error": {"message": "injected error", "type": "server_error", "code": None}})
+        self._send_json(200, {"text": "これは負荷試験用の文字起こしです。微分と積分について説明します。"})
+
+    def _chat_completion(self):
+        failed = self.server.behaviors["chat"].apply()
+        self.server.count("chat", failed)
+        if failed:
+            return self._send_json(500, {"error": {"message": "injected error", "type": "server_error", "code": None}})
+        self._send_json(200, {
+            "id": "chatcmpl-standin",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "standin",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "負荷試験用の応答です。"},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 1000, "completion_tokens": 200, "total_tokens": 1200},
+        })
+
+    def _send_json(self, status_code, body, headers=None):
+        content = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def add_standin_arguments(parser):
+    """
+    代替サービスの遅延とエラー注入のオプション (loadtest コマンドと共通)
+    """
+    parser.add_argument('--youtube-latency-ms', type=float, default=80, help="YouTube Data API の応答遅延 (デフォルト: 80)")
+    parser.add_argument('--whisper-latency-ms', type=float, default=1500, help="Whisper API の応答遅延 (デフォルト: 1500)")
+    parser.add_argument('--chat-latency-ms', type=float, default=3000, help="Chat Completions API の応答遅延 (デフォルト: 3000)")
+    parser.add_argument('--download-latency-ms', type=float, default=500, help="yt-dlp の代替のダウンロード時間 (デフォルト: 500)")
+    parser.add_argument('--jitter', type=float, default=0.2, help="各遅延に加えるゆらぎの割合 (デフォルト: 0.2)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="全ての代替サービスでエラーを返す確率 (デフォルト: 0)")
+
+
+def build_standin_server(options, host='127.0.0.1', port=0):
+    """
+    add_standin_arguments のオプションから代替サービスのサーバーを作成する (port=0 の場合は空いているポートを使う)
+    """
+    def behavior(latency_ms):
+        return ServiceBehavior(latency_ms=latency_ms, jitter_ms=latency_ms * options['jitter'], error_rate=options['error_rate'])
+
+    return StandinServer(
+        (host, port),
+        youtube=behavior(options['youtube_latency_ms']),
+        whisper=behavior(options['whisper_latency_ms']),
+        chat=behavior(options['chat_latency_ms']),
+    )
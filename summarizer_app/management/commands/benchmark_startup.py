@@ -0,0 +1,86 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# 子プロセスで実行するスクリプト。Djangoの初期化とURL設定 (= views.py) の読み込みが終わるまでを
+# "ready" とし、--warm-clients 指定時は続けて外部APIクライアントの作成時間も計測する。
+CHILD_SCRIPT = """
+import json, os, sys, time
+t_start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+t_ready = time.perf_counter()
+result = {{"ready_seconds": t_ready - t_start}}
+if {warm_clients!r}:
+    from summarizer_app.clients import get_openai_client, youtube_client
+    get_openai_client()
+    with youtube_client():
+        pass
+    result["clients_seconds"] = time.perf_counter() - t_ready
+sys.stdout.write("\\n" + json.dumps(result) + "\\n")
+"""
+
+
+class Command(BaseCommand):
+    help = "ワーカープロセスの起動時間 (インポートからリクエスト受付可能になるまで) を計測する"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help="計測回数 (デフォルト: 5)")
+        parser.add_argument(
+            '--warm-clients', action='store_true',
+            help="起動後に OpenAI / YouTube Data API クライアントの作成時間も計測する",
+        )
+
+    def handle(self, *args, **options):
+        runs = options['runs']
+        if runs < 1:
+            raise CommandError("--runs には1以上を指定してください。")
+
+        script = CHILD_SCRIPT.format(
+            settings_module=os.environ.get('DJANGO_SETTINGS_MODULE', 'youtube_summarizer_project.settings'),
+            warm_clients=options['warm_clients'],
+        )
+
+        samples = {"process_seconds": [], "ready_seconds": [], "clients_seconds": []}
+        for i in range(runs):
+            t_spawn = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, '-c', script],
+                cwd=settings.BASE_DIR,
+                capture_output=True,
+                text=True,
+            )
+            process_seconds = time.perf_counter() - t_spawn
+            if completed.returncode != 0:
+                raise CommandError(f"計測用プロセスが異常終了しました (リターンコード {completed.returncode}):\n{completed.stderr}")
+
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            samples["process_seconds"].append(process_seconds)
+            for key, value in result.items():
+                samples[key].append(value)
+            self.stdout.write(f"  run {i + 1}/{runs}: " + ", ".join(
+                f"{key}={value:.3f}s" for key, value in [("process", process_seconds)] + list(result.items())
+            ))
+
+        self.stdout.write("")
+        labels = {
+            "process_seconds": "プロセス起動からready (インタプリタ起動を含む)",
+            "ready_seconds": "インポート開始からready",
+            "clients_seconds": "APIクライアント作成",
+        }
+        for key, values in samples.items():
+            if not values:
+                continue
+            self.stdout.write(
+                f"{labels[key]}: min={min(values):.3f}s median={statistics.median(values):.3f}s max={max(values):.3f}s"
+            )
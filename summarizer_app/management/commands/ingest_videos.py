@@ -0,0 +1,195 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from summarizer_app.models import VideoSummary
+from summarizer_app.scheduling import completion_scheduler, transcription_scheduler
+from summarizer_app.views import SummarizationError, YoutubePaidSummarizerAPI
+
+
+class Command(BaseCommand):
+    help = (
+        "リンクの一覧ファイルを読み込み、動画の要約をまとめて作成してDBに保存する。"
+        "進捗はチェックポイントファイルに動画ごとに記録され、中断しても続きから再開できる。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input_path',
+            help="YouTubeリンクの一覧ファイル。1行に1リンク、またはJSONL (各行の --link-field のキーからリンクを読む)",
+        )
+        parser.add_argument('--workers', type=int, default=2, help="並行して処理する動画数 (デフォルト: 2)")
+        parser.add_argument(
+            '--transcription-concurrency', type=int, default=settings.INGEST_TRANSCRIPTION_MAX_CONCURRENCY,
+            help=f"Whisper API を同時に呼び出す数 (デフォルト: {settings.INGEST_TRANSCRIPTION_MAX_CONCURRENCY})",
+        )
+        parser.add_argument(
+            '--completion-concurrency', type=int, default=settings.INGEST_COMPLETION_MAX_CONCURRENCY,
+            help=f"Chat Completions API を同時に呼び出す数 (デフォルト: {settings.INGEST_COMPLETION_MAX_CONCURRENCY})",
+        )
+        parser.add_argument('--link-field', default='link', help="JSONL の場合にリンクを読み取るキー (デフォルト: link)")
+        parser.add_argument(
+            '--checkpoint',
+            help="チェックポイントファイルのパス (デフォルト: <input_path>.checkpoint.jsonl)",
+        )
+        parser.add_argument('--retry-failed', action='store_true', help="前回失敗した (または要約が不完全だった) 動画も再処理する")
+        parser.add_argument('--force', action='store_true', help="DBに保存済みの動画も再処理して上書きする")
+
+    def handle(self, *args, **options):
+        input_path = options['input_path']
+        workers = options['workers']
+        if workers < 1 or options['transcription_concurrency'] < 1 or options['completion_concurrency'] < 1:
+            raise CommandError("--workers, --transcription-concurrency, --completion-concurrency には1以上を指定してください。")
+        if not os.path.exists(input_path):
+            raise CommandError(f"入力ファイルが見つかりません: {input_path}")
+
+        checkpoint_path = options['checkpoint'] or f"{input_path}.checkpoint.jsonl"
+        checkpoint = _Checkpoint(checkpoint_path)
+
+        view = YoutubePaidSummarizerAPI()
+        videos = self._read_videos(input_path, options['link_field'], view)
+
+        existing_ids = set()
+        if not options['force']:
+            existing_ids = set(
+                VideoSummary.objects.filter(video_id__in=[video_id for video_id, _ in videos]).values_list('video_id', flat=True)
+            )
+
+        pending = []
+        for video_id, youtube_link in videos:
+            previous_status = checkpoint.statuses.get(video_id)
+            if previous_status == "done" and not options['force']:
+                continue
+            if previous_status in ("failed", "incomplete") and not (options['retry_failed'] or options['force']):
+                continue
+            if video_id in existing_ids:
+                checkpoint.record(video_id, "done", note="DBに保存済み")
+                continue
+            pending.append((video_id, youtube_link))
+
+        self.stdout.write(
+            f"{len(videos)} 件中 {len(pending)} 件を処理します (並行数: {workers}, チェックポイント: {checkpoint_path})"
+        )
+        if not pending:
+            return
+
+        # このコマンドは別プロセスで独自のスケジューラを持ち、Webのリクエストとは容量を共有しない。
+        # 同じ OpenAI のアカウントを使うWebへの影響を抑えるよう、API の同時呼び出し数を小さく制限する
+        transcription_scheduler.set_max_workers(options['transcription_concurrency'])
+        completion_scheduler.set_max_workers(options['completion_concurrency'])
+
+        counts = {"done": 0, "incomplete": 0, "failed": 0}
+        started_at = time.monotonic()
+        youtube_link_by_id = dict(pending)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = {
+                executor.submit(self._process_video, view, video_id, youtube_link): video_id
+                for video_id, youtube_link in pending
+            }
+            for finished, future in enumerate(as_completed(futures), start=1):
+                video_id = futures[future]
+                result_status, note, result = future.result()
+                if result is not None:
+                    # DBへの書き込みはメインスレッドでまとめて行う (SQLiteの同時書き込みによるロックを避ける)
+                    payload, transcript_segments = result
+                    try:
+                        VideoSummary.store(video_id, youtube_link_by_id[video_id], payload, transcript_segments)
+                    except DatabaseError as e:
+                        result_status, note = "failed", f"DBへの保存に失敗しました: {e}"
+                counts[result_status] += 1
+                checkpoint.record(video_id, result_status, note=note)
+                self.stdout.write(f"[{finished}/{len(pending)}] {video_id}: {result_status}" + (f" ({note})" if note else ""))
+        except KeyboardInterrupt:
+            self.stderr.write("中断されました。処理済みの動画はチェックポイントに記録されているため、再実行すると続きから再開します。")
+            raise
+        finally:
+            # 例外で抜ける場合も未着手の動画をキャンセルし、終了時の待ち合わせで残りの動画が処理され続けないようにする
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        elapsed = time.monotonic() - started_at
+        self.stdout.write(
+            f"完了: 成功 {counts['done']} 件, 要約不完全 {counts['incomplete']} 件, 失敗 {counts['failed']} 件 ({elapsed:.1f}秒)"
+        )
+
+    def _read_videos(self, input_path, link_field, view):
+        """
+        入力ファイルから (動画ID, リンク) のリストを読み込む。同じ動画が複数回出てくる場合は最初の1件のみ残す。
+        """
+        videos = []
+        seen_ids = set()
+        with open(input_path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('{'):
+                    try:
+                        youtube_link = json.loads(line).get(link_field)
+                    except json.JSONDecodeError as e:
+                        self.stderr.write(f"警告: {line_number}行目のJSONを解析できないためスキップします: {e}")
+                        continue
+                else:
+                    youtube_link = line
+
+                video_id = view._extract_video_id(youtube_link) if isinstance(youtube_link, str) else None
+                if not video_id:
+                    self.stderr.write(f"警告: {line_number}行目から動画IDを抽出できないためスキップします")
+                    continue
+                if video_id in seen_ids:
+                    continue
+                seen_ids.add(video_id)
+                videos.append((video_id, youtube_link))
+        return videos
+
+    def _process_video(self, view, video_id, youtube_link):
+        """
+        1本の動画を処理し、(結果のステータス, 補足, 保存する結果) を返す。ワーカースレッドで実行される。
+        """
+        try:
+            payload, transcript_segments, complete = view.summarize_video(youtube_link, video_id)
+            if not complete:
+                # 文字起こしが空、または練習問題の生成に失敗した場合はAPIと同様に保存しない
+                return "incomplete", None, None
+            return "done", None, (payload, transcript_segments)
+        except SummarizationError as e:
+            return "failed", e.body.get("error"), None
+        except Exception as e:
+            return "failed", str(e), None
+
+
+class _Checkpoint:
+    """
+    動画ごとの処理結果を追記するJSONLファイル。同じ動画の記録が複数ある場合は最後のものが有効になる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue # 書き込み途中で中断された行は無視する
+                    self.statuses[entry["video_id"]] = entry["status"]
+
+    def record(self, video_id, result_status, note=None):
+        entry = {"video_id": video_id, "status": result_status, "recorded_at": time.time()}
+        if note:
+            entry["note"] = note
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.statuses[video_id] = result_status
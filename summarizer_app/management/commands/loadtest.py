@@ -0,0 +1,211 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from summarizer_app.loadtest.runner import (
+    ResourceSampler, api_key_for_user, build_report, compare_to_baseline, load_json, run_load, save_json,
+)
+from summarizer_app.loadtest.standins import add_standin_arguments, build_standin_server
+
+
+class Command(BaseCommand):
+    help = (
+        "複数の仮想ユーザーから要約API (api/summarize_paid_audio/) に同時にリクエストを送る負荷試験を行い、"
+        "スループット・レイテンシ (p50/p95/p99)・エラー率・サーバーのリソース使用量のピークを報告する。"
+        "--target を省略した場合は、代替サービスに接続したサーバーを起動して試験する。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help="同時に利用する仮想ユーザー数 (デフォルト: 50)")
+        parser.add_argument('--requests-per-user', type=int, default=1, help="仮想ユーザーごとのリクエスト数 (デフォルト: 1)")
+        parser.add_argument(
+            '--durations', default='60,600,1800',
+            help="動画の長さ (秒) の候補をカンマ区切りで指定。各リクエストで無作為に選ぶ (デフォルト: 60,600,1800)",
+        )
+        parser.add_argument('--seed', type=int, default=0, help="動画の長さを選ぶ乱数のシード (デフォルト: 0)")
+        parser.add_argument('--timeout', type=float, default=1800, help="1リクエストのタイムアウト秒数 (デフォルト: 1800)")
+
+        parser.add_argument(
+            '--target',
+            help="試験対象のURL (例: http://127.0.0.1:8000/api/summarize_paid_audio/)。"
+                 "仮想ユーザーを別のクライアントとして扱うには、サーバーの CLIENT_API_KEYS に loadtest-user-0 から loadtest-user-<users-1> を登録する",
+        )
+        parser.add_argument('--server-pid', type=int, help="--target 指定時に、リソース使用量を計測するサーバーのプロセスID")
+        parser.add_argument('--temp-dir', help="--target 指定時に、ディスク使用量を計測するサーバーの一時ディレクトリ")
+        parser.add_argument(
+            '--server-env', action='append', default=[], metavar='KEY=VALUE',
+            help="起動するサーバーに追加で渡す環境変数 (例: TRANSCRIPTION_CHUNK_STORAGE=memory)。複数指定可",
+        )
+        add_standin_arguments(parser)
+
+        parser.add_argument('--output', help="レポートをJSONで保存するパス")
+        parser.add_argument('--baseline', help="比較するベースラインのレポート。悪化していれば失敗 (終了コード1) とする")
+        parser.add_argument('--save-baseline', help="今回のレポートをベースラインとして保存するパス")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="ベースラインから許容する悪化の割合 (デフォルト: 0.2)")
+        parser.add_argument(
+            '--error-rate-tolerance', type=float, default=0.01,
+            help="ベースラインから許容するエラー率の増加 (絶対値, デフォルト: 0.01)",
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['requests_per_user'] < 1:
+            raise CommandError("--users と --requests-per-user には1以上を指定してください。")
+        try:
+            durations = [int(value) for value in options['durations'].split(',') if value.strip()]
+        except ValueError:
+            raise CommandError(f"--durations には秒数をカンマ区切りで指定してください: {options['durations']}")
+        if not durations or not all(0 < value <= 99999 for value in durations):
+            raise CommandError("--durations の各値は 1 から 99999 の範囲で指定してください。")
+
+        if options['target']:
+            report = self._run(options['target'], options['server_pid'], options['temp_dir'], durations, options)
+        else:
+            report = self._run_with_local_server(durations, options)
+
+        self._print_report(report)
+
+        if options['output']:
+            save_json(options['output'], report)
+            self.stdout.write(f"レポートを保存しました: {options['output']}")
+        if options['save_baseline']:
+            save_json(options['save_baseline'], report)
+            self.stdout.write(f"ベースラインを保存しました: {options['save_baseline']}")
+        if options['baseline']:
+            regressions = compare_to_baseline(
+                report, load_json(options['baseline']), options['tolerance'], options['error_rate_tolerance']
+            )
+            if regressions:
+                raise CommandError("ベースラインから悪化しました:\n  " + "\n  ".join(regressions))
+            self.stdout.write(self.style.SUCCESS(f"ベースライン ({options['baseline']}) の許容範囲内です。"))
+
+    def _run(self, target_url, server_pid, temp_dir, durations, options):
+        self.stdout.write(
+            f"負荷試験を開始します: {target_url} (ユーザー数 {options['users']}, "
+            f"ユーザーごとのリクエスト数 {options['requests_per_user']}, 動画の長さ {durations}秒)"
+        )
+        sampler = ResourceSampler(pid=server_pid, temp_dir=temp_dir)
+        sampler.start()
+        try:
+            results, wall_seconds = run_load(
+                target_url, options['users'], options['requests_per_user'], durations, options['timeout'], options['seed']
+            )
+        finally:
+            peaks = sampler.stop()
+        return build_report(results, wall_seconds, peaks)
+
+    def _run_with_local_server(self, durations, options):
+        """
+        代替サービスと、それに接続した試験用のサーバー (manage.py runserver) を起動して負荷試験を行う。
+        DBと一時ディレクトリは試験用の作業ディレクトリに作成し、終了後に削除する。
+        """
+        work_dir = tempfile.mkdtemp(prefix='loadtest-')
+        standins = build_standin_server(options)
+        standins.start_in_background()
+        server = None
+        log_path = os.path.join(work_dir, 'server.log')
+        try:
+            media_root = os.path.join(work_dir, 'media')
+            os.makedirs(media_root)
+            env = os.environ.copy()
+            env.update({
+                'SQLITE_PATH': os.path.join(work_dir, 'db.sqlite3'),
+                'MEDIA_ROOT': media_root,
+                'OPENAI_API_KEY': 'loadtest',
+                'OPENAI_BASE_URL': f"{standins.base_url}/v1",
+                'YOUTUBE_API_KEY': 'loadtest',
+                'YOUTUBE_API_ENDPOINT': f"{standins.base_url}/",
+                'YT_DLP_COMMAND': f"{sys.executable} -m summarizer_app.loadtest.fake_yt_dlp",
+                'STANDIN_YT_DLP_LATENCY_MS': str(options['download_latency_ms']),
+                'STANDIN_YT_DLP_ERROR_RATE': str(options['error_rate']),
+                'CLIENT_API_KEYS': ",".join(api_key_for_user(i) for i in range(options['users'])),
+                # 負荷試験ではクォータで弾かれないようにする
+                'QUOTA_AUDIO_MINUTES_PER_WINDOW': str(10 ** 9),
+                'QUOTA_TOKENS_PER_WINDOW': str(10 ** 12),
+            })
+            for assignment in options['server_env']:
+                key, separator, value = assignment.partition('=')
+                if not separator:
+                    raise CommandError(f"--server-env は KEY=VALUE の形式で指定してください: {assignment}")
+                env[key] = value
+
+            manage_py = os.path.join(settings.BASE_DIR, 'manage.py')
+            subprocess.run([sys.executable, manage_py, 'migrate', '--verbosity', '0'], env=env, cwd=settings.BASE_DIR, check=True)
+
+            port = _free_port()
+            with open(log_path, 'wb') as log_file:
+                server = subprocess.Popen(
+                    [sys.executable, manage_py, 'runserver', f'127.0.0.1:{port}', '--noreload'],
+                    env=env, cwd=settings.BASE_DIR, stdout=log_file, stderr=subprocess.STDOUT,
+                )
+            base_url = f"http://127.0.0.1:{port}"
+            self._wait_until_ready(server, f"{base_url}/api/usage/", log_path)
+            self.stdout.write(f"試験用のサーバーを起動しました: {base_url} (代替サービス: {standins.base_url})")
+
+            report = self._run(f"{base_url}/api/summarize_paid_audio/", server.pid, media_root, durations, options)
+            report["standin_requests"] = dict(standins.request_counts)
+            return report
+        finally:
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+                    server.wait()
+            standins.shutdown()
+            standins.server_close()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _wait_until_ready(self, server, url, log_path, timeout_seconds=60):
+        deadline = time.monotonic() + timeout_seconds
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                break
+            try:
+                if httpx.get(url, timeout=2).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        with open(log_path, encoding='utf-8', errors='replace') as f:
+            log_tail = f.read()[-4000:]
+        raise CommandError(f"試験用のサーバーが起動しませんでした。ログ:\n{log_tail}")
+
+    def _print_report(self, report):
+        latency = report["latency_seconds"]
+
+        def seconds(value):
+            return f"{value:.2f}s" if value is not None else "-"
+
+        def optional(value):
+            return value if value is not None else "-"
+
+        self.stdout.write("")
+        self.stdout.write(f"リクエスト数: {report['requests']} (成功 {report['succeeded']}, エラー {report['errors']})")
+        self.stdout.write(f"エラー率: {report['error_rate']:.2%}")
+        self.stdout.write(f"スループット: {report['throughput_rps']:.3f} req/s (所要時間 {report['wall_seconds']:.1f}s)")
+        self.stdout.write(
+            f"レイテンシ: p50={seconds(latency['p50'])} p95={seconds(latency['p95'])} "
+            f"p99={seconds(latency['p99'])} max={seconds(latency['max'])}"
+        )
+        self.stdout.write(f"ステータス: {json.dumps(report['status_counts'], ensure_ascii=False)}")
+        self.stdout.write(f"ピーク時の開いているファイル数: {optional(report['peak_open_files'])}")
+        self.stdout.write(f"ピーク時の子プロセス数: {optional(report['peak_child_processes'])}")
+        self.stdout.write(f"ピーク時の一時ディスク使用量: {optional(report['peak_temp_disk_bytes'])} bytes")
+        if "standin_requests" in report:
+            self.stdout.write(f"代替サービスへのリクエスト数: {json.dumps(report['standin_requests'], ensure_ascii=False)}")
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from summarizer_app.loadtest.standins import add_standin_arguments, build_standin_server
+
+
+class Command(BaseCommand):
+    help = (
+        "負荷試験用に YouTube Data API と OpenAI API の代替サービスを起動する。"
+        "デプロイ済みのサーバーを OPENAI_BASE_URL / YOUTUBE_API_ENDPOINT / YT_DLP_COMMAND でこれに向けて loadtest --target を実行する。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8900)
+        add_standin_arguments(parser)
+
+    def handle(self, *args, **options):
+        server = build_standin_server(options, options['host'], options['port'])
+        base_url = server.base_url
+        self.stdout.write(f"代替サービスを起動しました: {base_url}")
+        self.stdout.write("サーバー側の環境変数:")
+        self.stdout.write(f"  OPENAI_BASE_URL={base_url}/v1")
+        self.stdout.write(f"  YOUTUBE_API_ENDPOINT={base_url}/")
+        self.stdout.write(f"  YT_DLP_COMMAND=\"{sys.executable} -m summarizer_app.loadtest.fake_yt_dlp\"")
+        self.stdout.write(f"  STANDIN_YT_DLP_LATENCY_MS={options['download_latency_ms']}")
+        self.stdout.write(f"  STANDIN_YT_DLP_ERROR_RATE={options['error_rate']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"リクエスト数: {server.request_counts}")
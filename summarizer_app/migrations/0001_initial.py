@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('video_id', models.CharField(max_length=11, unique=True)),
+                ('youtube_link', models.URLField(max_length=500)),
+                ('title', models.TextField(blank=True)),
+                ('description', models.TextField(blank=True)),
+                ('transcript', models.TextField(blank=True)),
+                ('transcript_segments', models.JSONField(blank=True, default=list)),
+                ('summary', models.TextField(blank=True)),
+                ('practice_problems', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,3 +1,55 @@
 from django.db import models
 
 # Create your models here.
+
+
+class VideoSummary(models.Model):
+    """
+    要約処理が全ステップ成功した動画の結果。
+    同じ動画へのリクエストはここから返し、ingest_videos コマンドで事前に作成しておくこともできる。
+    """
+
+    video_id = models.CharField(max_length=11, unique=True)
+    youtube_link = models.URLField(max_length=500)
+    title = models.TextField(blank=True)
+    description = models.TextField(blank=True)
+    transcript = models.TextField(blank=True)
+    transcript_segments = models.JSONField(default=list, blank=True)
+    summary = models.TextField(blank=True)
+    practice_problems = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.video_id}: {self.title}"
+
+    @classmethod
+    def store(cls, video_id, youtube_link, payload, transcript_segments):
+        """
+        YoutubePaidSummarizerAPI.summarize_video の結果を保存する (既存の結果は上書きする)
+        """
+        summary, _ = cls.objects.update_or_create(
+            video_id=video_id,
+            defaults={
+                "youtube_link": youtube_link,
+                "title": payload["title"],
+                "description": payload["description"],
+                "transcript": payload["transcript"],
+                "transcript_segments": transcript_segments,
+                "summary": payload["summary"],
+                "practice_problems": payload["practice_problems"],
+            },
+        )
+        return summary
+
+    def to_payload(self):
+        """
+        APIレスポンスと同じ形式の辞書を返す
+        """
+        return {
+            "title": self.title,
+            "description": self.description,
+            "transcript": self.transcript,
+            "summary": self.summary,
+            "practice_problems": self.practice_problems,
+        }
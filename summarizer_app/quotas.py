@@ -0,0 +1,145 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class QuotaExceeded(Exception):
+    """
+    クライアントの利用量が時間枠あたりの上限を超える場合に送出される
+    """
+
+    def __init__(self, message, usage):
+        super().__init__(message)
+        self.usage = usage
+
+
+def get_client_key(request):
+    """
+    クォータとスケジューリングの単位となるクライアントのキーを返す。
+    ログインユーザー > X-API-Key ヘッダー > 接続元IPアドレス の順で識別する。
+    X-API-Key は settings.CLIENT_API_KEYS に登録されたキーの場合のみ使う
+    (任意の値を受け付けると、リクエストごとにキーを変えてクォータと公平な割り当てを回避できてしまう)。
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+
+    api_key = request.headers.get('X-API-Key')
+    if api_key and api_key in settings.CLIENT_API_KEYS:
+        # キー自体をキャッシュやログに残さないようにハッシュ化する
+        return f"key:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]}"
+
+    return f"ip:{request.META.get('REMOTE_ADDR', 'unknown')}"
+
+
+def reserve_audio_seconds(client_key, seconds):
+    """
+    文字起こしする音声の長さを利用量に加算する。上限を超える場合は加算せずに QuotaExceeded を送出する。
+    加算した時間枠を返すので、処理が失敗した場合は release_audio_seconds に渡して払い戻す。
+    """
+    limit = settings.QUOTA_AUDIO_MINUTES_PER_WINDOW * 60
+    window_start = _window_start()
+    used = _increment(client_key, "audio_seconds", seconds, window_start)
+    if used > limit:
+        _increment(client_key, "audio_seconds", -seconds, window_start)
+        raise QuotaExceeded(
+            f"音声の文字起こし時間の上限 ({settings.QUOTA_AUDIO_MINUTES_PER_WINDOW}分) を超えるため処理できません。",
+            get_usage(client_key),
+        )
+    return window_start
+
+
+def release_audio_seconds(client_key, seconds, window_start):
+    """
+    reserve_audio_seconds で加算した音声の長さを払い戻す (文字起こしや要約が失敗し、結果を返せなかった場合)。
+    時間枠が既に切り替わっている場合は、新しい時間枠の利用量を減らさないよう何もしない。
+    """
+    try:
+        cache.decr(_cache_key(client_key, "audio_seconds", window_start), seconds)
+    except ValueError:
+        pass # 時間枠のキーが期限切れになっている
+
+
+def check_audio_quota(client_key):
+    """
+    時間枠内の音声の文字起こし時間が上限に達している場合は QuotaExceeded を送出する
+    (音声の長さが分かる前に、ダウンロードを始めてよいかを判断するために使う)
+    """
+    if _current(client_key, "audio_seconds") >= settings.QUOTA_AUDIO_MINUTES_PER_WINDOW * 60:
+        raise QuotaExceeded(
+            f"音声の文字起こし時間の上限 ({settings.QUOTA_AUDIO_MINUTES_PER_WINDOW}分) に達しています。",
+            get_usage(client_key),
+        )
+
+
+def check_token_quota(client_key):
+    """
+    時間枠内のトークン利用量が上限に達している場合は QuotaExceeded を送出する
+    """
+    if _current(client_key, "tokens") >= settings.QUOTA_TOKENS_PER_WINDOW:
+        raise QuotaExceeded(
+            f"トークン利用量の上限 ({settings.QUOTA_TOKENS_PER_WINDOW}) に達しています。",
+            get_usage(client_key),
+        )
+
+
+def record_tokens(client_key, tokens):
+    """
+    OpenAI API のレスポンスに含まれるトークン数を利用量に加算する
+    """
+    if tokens:
+        _increment(client_key, "tokens", tokens)
+
+
+def get_usage(client_key):
+    """
+    現在の時間枠でのクライアントの利用量と上限を返す
+    """
+    window_start = _window_start()
+    audio_minutes_used = _current(client_key, "audio_seconds") / 60
+    tokens_used = _current(client_key, "tokens")
+    return {
+        "client": client_key,
+        "window_seconds": settings.QUOTA_WINDOW_SECONDS,
+        "window_resets_at": window_start + settings.QUOTA_WINDOW_SECONDS,
+        "audio_minutes": {
+            "used": round(audio_minutes_used, 2),
+            "limit": settings.QUOTA_AUDIO_MINUTES_PER_WINDOW,
+            "remaining": round(max(settings.QUOTA_AUDIO_MINUTES_PER_WINDOW - audio_minutes_used, 0), 2),
+        },
+        "tokens": {
+            "used": tokens_used,
+            "limit": settings.QUOTA_TOKENS_PER_WINDOW,
+            "remaining": max(settings.QUOTA_TOKENS_PER_WINDOW - tokens_used, 0),
+        },
+    }
+
+
+def _window_start():
+    window = settings.QUOTA_WINDOW_SECONDS
+    return int(time.time() // window * window)
+
+
+def _cache_key(client_key, metric, window_start=None):
+    if window_start is None:
+        window_start = _window_start()
+    return f"quota:{client_key}:{metric}:{window_start}"
+
+
+def _current(client_key, metric):
+    return cache.get(_cache_key(client_key, metric), 0)
+
+
+def _increment(client_key, metric, amount, window_start=None):
+    # 複数ワーカープロセス間で利用量を共有するには、CACHES に Redis などの共有キャッシュを設定する
+    key = _cache_key(client_key, metric, window_start)
+    timeout = settings.QUOTA_WINDOW_SECONDS * 2
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key, amount)
+    except ValueError:
+        # add と incr の間にキーが期限切れになった場合
+        cache.set(key, amount, timeout)
+        return amount
@@ -0,0 +1,28 @@
+import orjson
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    orjson を使って高速にJSONへシリアライズするレンダラー。
+    DRF標準の JSONRenderer と異なり、インデントや空白を入れないコンパクトな出力のみを返す。
+    """
+
+    media_type = 'application/json'
+    format = 'json'
+    charset = None # orjson は常にUTF-8のバイト列を返す
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=self._default, option=orjson.OPT_NON_STR_KEYS)
+
+    @staticmethod
+    def _default(obj):
+        """
+        orjson が直接扱えない型 (DRFのエラーメッセージで使われる遅延翻訳文字列など) を変換する
+        """
+        if isinstance(obj, Promise):
+            return str(obj)
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
@@ -0,0 +1,76 @@
+# フィールド指定が無い場合に返すフィールド (従来のレスポンス形式)
+DEFAULT_FIELDS = ("title", "description", "transcript", "summary", "practice_problems")
+# ?fields= で指定できるフィールド
+AVAILABLE_FIELDS = DEFAULT_FIELDS + ("transcript_segments",)
+
+DEFAULT_SEGMENT_LIMIT = 20
+MAX_SEGMENT_LIMIT = 100
+
+
+class ResponseShapingError(ValueError):
+    """
+    クエリパラメータが不正な場合に送出される
+    """
+
+
+def parse_shaping_params(query_params):
+    """
+    クエリパラメータからフィールド選択とページネーションの指定を読み取る。
+    重い処理を始める前に検証できるよう、リクエスト受信直後に呼び出す。
+    """
+    fields_param = query_params.get("fields")
+    offset_param = query_params.get("segment_offset")
+    limit_param = query_params.get("segment_limit")
+
+    if fields_param:
+        fields = [field.strip() for field in fields_param.split(",") if field.strip()]
+        unknown_fields = [field for field in fields if field not in AVAILABLE_FIELDS]
+        if unknown_fields:
+            raise ResponseShapingError(
+                f"不明なフィールドが指定されました: {', '.join(unknown_fields)} (指定可能: {', '.join(AVAILABLE_FIELDS)})"
+            )
+    else:
+        fields = list(DEFAULT_FIELDS)
+        # ページネーションの指定があればセグメントも返す
+        if offset_param is not None or limit_param is not None:
+            fields.append("transcript_segments")
+
+    offset = _parse_non_negative_int(offset_param, "segment_offset", 0)
+    limit = _parse_non_negative_int(limit_param, "segment_limit", DEFAULT_SEGMENT_LIMIT)
+    if limit < 1 or limit > MAX_SEGMENT_LIMIT:
+        raise ResponseShapingError(f"segment_limit は 1 から {MAX_SEGMENT_LIMIT} の範囲で指定してください。")
+
+    return {"fields": fields, "segment_offset": offset, "segment_limit": limit}
+
+
+def shape_response(payload, segments, shaping):
+    """
+    レスポンスのペイロードから要求されたフィールドだけを残し、
+    transcript_segments が要求されていればページ分だけ切り出して付与する。
+    """
+    shaped = {field: payload[field] for field in shaping["fields"] if field in payload}
+
+    if "transcript_segments" in shaping["fields"]:
+        offset = shaping["segment_offset"]
+        limit = shaping["segment_limit"]
+        shaped["transcript_segments"] = segments[offset:offset + limit]
+        shaped["transcript_segments_pagination"] = {
+            "offset": offset,
+            "limit": limit,
+            "total": len(segments),
+            "has_more": offset + limit < len(segments),
+        }
+
+    return shaped
+
+
+def _parse_non_negative_int(value, name, default):
+    if value is None or value == "":
+        return default
+    try:
+        parsed = int(value)
+    except ValueError:
+        raise ResponseShapingError(f"{name} には整数を指定してください: {value}")
+    if parsed < 0:
+        raise ResponseShapingError(f"{name} には0以上の整数を指定してください: {value}")
+    return parsed
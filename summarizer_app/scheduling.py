@@ -0,0 +1,110 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from django.conf import settings
+
+
+class FairScheduler:
+    """
+    全リクエストで共有するワーカープールに、クライアントごとのキューから重み付きで公平にタスクを割り当てる。
+    (start-time fair queueing: 仮想時間が最も小さいクライアントのタスクから実行し、
+    実行するたびにそのクライアントの仮想時間を 1 / 重み だけ進める)
+
+    1人のクライアントが大量のタスクを投入しても、後から来た他のクライアントのタスクは
+    その後ろに並ばずに交互に実行されるため、対話的な利用者の待ち時間が予測可能になる。
+    """
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self._condition = threading.Condition()
+        self._queues = {} # client_key -> deque[(future, fn, args, kwargs)] (タスク待ちのクライアントのみ)
+        self._virtual_times = {} # client_key -> 仮想時間 (タスク待ちのクライアントのみ)
+        self._virtual_clock = 0.0 # 最後に実行を開始したタスクの仮想時間
+        self._workers = []
+
+    def submit(self, client_key, fn, *args, **kwargs):
+        """
+        タスクをクライアントのキューに追加し、結果を受け取る Future を返す
+        """
+        future = Future()
+        with self._condition:
+            queue = self._queues.get(client_key)
+            if queue is None:
+                queue = self._queues[client_key] = deque()
+                # 新たにタスク待ちになったクライアントは現在の仮想時間から始める
+                # (待っていなかった間の分の優先度を貯め込ませない)
+                self._virtual_times[client_key] = self._virtual_clock
+            queue.append((future, fn, args, kwargs))
+            self._start_workers()
+            self._condition.notify()
+        return future
+
+    def set_max_workers(self, max_workers):
+        """
+        ワーカー数の上限を変更する。起動済みのワーカーは減らないため、上限を下げる場合はタスクを投入する前に呼び出す
+        """
+        with self._condition:
+            self.max_workers = max_workers
+
+    def queued_count(self, client_key):
+        """
+        クライアントの実行待ちタスク数を返す
+        """
+        with self._condition:
+            queue = self._queues.get(client_key)
+            return len(queue) if queue else 0
+
+    def _start_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"{self.name}-{len(self._workers)}",
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _next_task(self):
+        with self._condition:
+            while not self._queues:
+                self._condition.wait()
+
+            client_key = min(self._queues, key=self._virtual_times.__getitem__)
+            queue = self._queues[client_key]
+            task = queue.popleft()
+
+            self._virtual_clock = self._virtual_times[client_key]
+            if queue:
+                self._virtual_times[client_key] += 1 / get_client_weight(client_key)
+            else:
+                del self._queues[client_key]
+                del self._virtual_times[client_key]
+            return task
+
+    def _worker_loop(self):
+        while True:
+            future, fn, args, kwargs = self._next_task()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+def get_client_weight(client_key):
+    """
+    settings.FAIR_SCHEDULER_WEIGHTS からクライアントの重みを取得する (大きいほど多く割り当てられる)
+    """
+    return settings.FAIR_SCHEDULER_WEIGHTS.get(client_key, settings.FAIR_SCHEDULER_DEFAULT_WEIGHT)
+
+
+# --- 共有スケジューラ ---
+# Whisper による文字起こしと GPT による生成はそれぞれ別の容量として管理する。
+# 容量はプロセス内でのみ共有される (ingest_videos コマンドなど別プロセスの処理とは共有しない)
+transcription_scheduler = FairScheduler("transcription", settings.TRANSCRIPTION_MAX_CONCURRENCY)
+completion_scheduler = FairScheduler("completion", settings.COMPLETION_MAX_CONCURRENCY)
@@ -1,3 +1,406 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import orjson
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from .chunk_buffers import ChunkBuffer, MemoryBudget
+from .loadtest.runner import compare_to_baseline
+from .models import VideoSummary
+from .renderers import ORJSONRenderer
+from .quotas import QuotaExceeded, get_client_key, get_usage, release_audio_seconds, reserve_audio_seconds
+from .response_shaping import MAX_SEGMENT_LIMIT, ResponseShapingError, parse_shaping_params, shape_response
+from .scheduling import FairScheduler
+from .transcript_compaction import MAX_KEPT_BLOCKS, OMISSION_MARKER, clean_transcript, count_tokens, fit_to_token_budget
+from .views import YoutubePaidSummarizerAPI
+
+
+class CleanTranscriptTests(SimpleTestCase):
+
+    def test_numbers_are_not_collapsed(self):
+        for text in ['答えは1000000です。', 'x=0.3333333', '1000000000は10億', 'ABABAB型', '１１１１１円']:
+            with self.subTest(text=text):
+                self.assertEqual(clean_transcript(text), text)
+
+    def test_short_repetition_is_kept(self):
+        # 3回程度の繰り返しは話し言葉として自然なので残す
+        self.assertEqual(clean_transcript('はいはいはい、始めます。'), 'はいはいはい、始めます。')
+
+    def test_hallucinated_repetition_is_collapsed(self):
+        self.assertEqual(clean_transcript('ご視聴ありがとうございました' * 5 + '。'), 'ご視聴ありがとうございました。')
+        self.assertEqual(clean_transcript('はいはいはいはいはい、始めます。'), 'はい、始めます。')
+
+    def test_filler_is_removed_only_at_word_boundary(self):
+        self.assertEqual(clean_transcript('えーと、微分です。'), '微分です。')
+        self.assertEqual(clean_transcript('微分です。えー、積分です。'), '微分です。積分です。')
+        self.assertEqual(clean_transcript('ねえー'), 'ねえー')
+        self.assertEqual(clean_transcript('そのあの、問題'), 'そのあの、問題')
+
+    def test_filler_is_not_cut_from_the_following_word(self):
+        self.assertEqual(clean_transcript('えーっと、これは'), 'これは')
+        self.assertEqual(clean_transcript('うーんと、はい'), 'はい')
+        for text in ['あーいうことです', 'まぁいいか', 'えーき', 'umbrella']:
+            with self.subTest(text=text):
+                self.assertEqual(clean_transcript(text), text)
+
+    def test_error_markers_are_removed(self):
+        self.assertEqual(clean_transcript('微分です。[文字起こしエラー: timeout]積分です。'), '微分です。積分です。')
+
+
+class FitToTokenBudgetTests(SimpleTestCase):
+
+    def setUp(self):
+        self.text = "今日は微分について説明します。" + "".join(f"これは第{i}番目の文で、関数の傾きを求める方法を話しています。" for i in range(1000))
+
+    def test_text_within_budget_is_unchanged(self):
+        self.assertEqual(fit_to_token_budget("短い文です。", "gpt-4", 100), "短い文です。")
+
+    def test_opening_is_kept_and_markers_are_capped(self):
+        fitted = fit_to_token_budget(self.text, "gpt-4", 6000)
+        self.assertLessEqual(count_tokens(fitted, "gpt-4"), 6000)
+        self.assertTrue(fitted.startswith("今日は微分について説明します。"))
+        self.assertLessEqual(fitted.count(OMISSION_MARKER), MAX_KEPT_BLOCKS)
+        # 冒頭だけでなく動画の後半からも残す
+        self.assertIn("番目の文", fitted.rsplit(OMISSION_MARKER, 2)[1])
+
+    def test_small_budget_keeps_a_single_opening_block(self):
+        fitted = fit_to_token_budget(self.text, "gpt-4", 200)
+        self.assertLessEqual(count_tokens(fitted, "gpt-4"), 200)
+        self.assertTrue(fitted.startswith("今日は"))
+        self.assertEqual(fitted.count(OMISSION_MARKER), 1)
+
+
+class ResponseShapingTests(SimpleTestCase):
+
+    payload = {"title": "t", "description": "d", "transcript": "文字起こし", "summary": "要約", "practice_problems": "問題"}
+    segments = [{"index": i, "start_seconds": i * 120, "end_seconds": (i + 1) * 120, "text": f"セグメント{i}"} for i in range(5)]
+
+    def test_default_fields(self):
+        shaping = parse_shaping_params({})
+        self.assertEqual(shape_response(self.payload, self.segments, shaping), self.payload)
+
+    def test_unknown_field_is_rejected(self):
+        with self.assertRaises(ResponseShapingError):
+            parse_shaping_params({"fields": "summary,secret"})
+
+    def test_selected_fields_only(self):
+        shaped = shape_response(self.payload, self.segments, parse_shaping_params({"fields": "title, summary"}))
+        self.assertEqual(shaped, {"title": "t", "summary": "要約"})
+
+    def test_segment_bounds_are_validated(self):
+        for params in [{"segment_offset": "-1"}, {"segment_offset": "abc"}, {"segment_limit": "0"}, {"segment_limit": str(MAX_SEGMENT_LIMIT + 1)}]:
+            with self.subTest(params=params), self.assertRaises(ResponseShapingError):
+                parse_shaping_params(params)
+
+    def test_pagination_params_alone_add_segments(self):
+        shaped = shape_response(self.payload, self.segments, parse_shaping_params({"segment_offset": "2", "segment_limit": "2"}))
+        self.assertEqual(set(self.payload) - set(shaped), set())
+        self.assertEqual([segment["index"] for segment in shaped["transcript_segments"]], [2, 3])
+        self.assertEqual(shaped["transcript_segments_pagination"], {"offset": 2, "limit": 2, "total": 5, "has_more": True})
+
+    def test_last_page_has_no_more(self):
+        shaped = shape_response(self.payload, self.segments, parse_shaping_params({"fields": "transcript_segments", "segment_offset": "3"}))
+        self.assertEqual([segment["index"] for segment in shaped["transcript_segments"]], [3, 4])
+        self.assertFalse(shaped["transcript_segments_pagination"]["has_more"])
+
+
+@override_settings(QUOTA_AUDIO_MINUTES_PER_WINDOW=10)
+class AudioQuotaTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_released_reservation_is_refunded(self):
+        window_start = reserve_audio_seconds("key:test", 480)
+        with self.assertRaises(QuotaExceeded):
+            reserve_audio_seconds("key:test", 480)
+
+        release_audio_seconds("key:test", 480, window_start)
+        self.assertEqual(get_usage("key:test")["audio_minutes"]["used"], 0)
+        reserve_audio_seconds("key:test", 480)
+
+    def test_release_after_window_change_does_not_touch_new_window(self):
+        reserve_audio_seconds("key:test", 300)
+        release_audio_seconds("key:test", 300, window_start=0)
+        self.assertEqual(get_usage("key:test")["audio_minutes"]["used"], 5)
+
+
+@override_settings(CLIENT_API_KEYS=frozenset({"registered-key"}))
+class ClientKeyTests(SimpleTestCase):
+
+    def test_registered_api_key_identifies_client(self):
+        request = RequestFactory().post("/", HTTP_X_API_KEY="registered-key", REMOTE_ADDR="10.0.0.1")
+        self.assertTrue(get_client_key(request).startswith("key:"))
+
+    def test_unregistered_api_key_falls_back_to_ip(self):
+        for api_key in ["random-1", "random-2"]:
+            request = RequestFactory().post("/", HTTP_X_API_KEY=api_key, REMOTE_ADDR="10.0.0.1")
+            self.assertEqual(get_client_key(request), "ip:10.0.0.1")
+
+
+@override_settings(FAIR_SCHEDULER_WEIGHTS={"heavy": 2.0}, FAIR_SCHEDULER_DEFAULT_WEIGHT=1.0)
+class FairSchedulerTests(SimpleTestCase):
+
+    def setUp(self):
+        # ワーカーを起動せず、_next_task で取り出したタスクをテストから順に実行する
+        self.scheduler = FairScheduler("test", max_workers=0)
+        self.order = []
+
+    def submit(self, client_key, count):
+        for _ in range(count):
+            self.scheduler.submit(client_key, self.order.append, client_key)
+
+    def run_tasks(self, count):
+        for _ in range(count):
+            future, fn, args, kwargs = self.scheduler._next_task()
+            future.set_running_or_notify_cancel()
+            future.set_result(fn(*args, **kwargs))
+
+    def test_clients_are_interleaved_by_weight(self):
+        self.submit("light", 6)
+        self.submit("heavy", 6)
+        self.run_tasks(9)
+        # 重み2のクライアントは重み1のクライアントの2倍実行される
+        self.assertEqual(self.order.count("heavy"), 6)
+        self.assertEqual(self.order.count("light"), 3)
+        self.assertEqual(self.order[:3], ["light", "heavy", "heavy"])
+
+    def test_returning_client_starts_from_current_virtual_time(self):
+        self.submit("idle", 1)
+        self.submit("busy", 10)
+        self.run_tasks(7)
+        self.assertEqual(self.order.count("idle"), 1)
+
+        # しばらく待っていなかったクライアントは優先度を貯め込まず、現在の仮想時間から交互に実行される
+        self.order.clear()
+        self.submit("idle", 4)
+        self.run_tasks(6)
+        self.assertEqual(self.order, ["idle", "busy", "idle", "busy", "idle", "busy"])
+        self.assertEqual(self.scheduler.queued_count("idle"), 1)
+
+
+class CompareToBaselineTests(SimpleTestCase):
+
+    def report(self, p50=0.4, p95=0.6, open_files=30, child_processes=4, error_rate=0.0):
+        return {
+            "throughput_rps": 2.0,
+            "error_rate": error_rate,
+            "latency_seconds": {"p50": p50, "p95": p95, "p99": p95},
+            "peak_open_files": open_files,
+            "peak_child_processes": child_processes,
+            "peak_temp_disk_bytes": 1000,
+        }
+
+    def test_within_tolerance(self):
+        self.assertEqual(compare_to_baseline(self.report(p50=0.45), self.report(), 0.2, 0.01), [])
+
+    def test_sub_second_latency_regression_is_detected(self):
+        regressions = compare_to_baseline(self.report(p50=1.3, p95=1.5), self.report(), 0.2, 0.01)
+        self.assertEqual([message.split(":")[0] for message in regressions], ["latency_seconds.p50", "latency_seconds.p95", "latency_seconds.p99"])
+
+    def test_small_counts_have_one_unit_of_slack(self):
+        self.assertEqual(compare_to_baseline(self.report(child_processes=5), self.report(), 0.2, 0.01), [])
+        regressions = compare_to_baseline(self.report(child_processes=6), self.report(), 0.2, 0.01)
+        self.assertEqual([message.split(":")[0] for message in regressions], ["peak_child_processes"])
+
+    def test_error_rate_uses_absolute_tolerance(self):
+        self.assertEqual(compare_to_baseline(self.report(error_rate=0.005), self.report(), 0.2, 0.01), [])
+        self.assertEqual(len(compare_to_baseline(self.report(error_rate=0.05), self.report(), 0.2, 0.01)), 1)
+
+
+PAYLOAD = {"title": "t", "description": "d", "transcript": "文字起こし", "summary": "要約", "practice_problems": "問題"}
+
+
+class YoutubePaidSummarizerAPITests(TestCase):
+
+    def test_result_is_returned_when_storing_fails(self):
+        with mock.patch.object(YoutubePaidSummarizerAPI, 'summarize_video', return_value=(PAYLOAD, [], True)), \
+                mock.patch('summarizer_app.views.VideoSummary.store', side_effect=OperationalError("database is locked")):
+            response = self.client.post(
+                '/api/summarize_paid_audio/', {"link": "https://www.youtube.com/watch?v=abcdefghijk"}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["summary"], "要約")
+
+    def test_unreadable_database_is_treated_as_cache_miss(self):
+        with mock.patch.object(YoutubePaidSummarizerAPI, 'summarize_video', return_value=(PAYLOAD, [], True)), \
+                mock.patch('summarizer_app.views.VideoSummary.objects.filter', side_effect=OperationalError("no such table")):
+            response = self.client.post(
+                '/api/summarize_paid_audio/', {"link": "https://www.youtube.com/watch?v=abcdefghijk"}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["summary"], "要約")
+
+    def test_response_is_rendered_with_orjson_and_gzipped(self):
+        VideoSummary.objects.create(
+            video_id="abcdefghijk", youtube_link="https://www.youtube.com/watch?v=abcdefghijk",
+            title="t", description="d", transcript="文字起こし" * 100, summary="要約", practice_problems="問題",
+        )
+        response = self.client.post(
+            '/api/summarize_paid_audio/?fields=summary,transcript', {"link": "https://www.youtube.com/watch?v=abcdefghijk"},
+            content_type='application/json', HTTP_ACCEPT_ENCODING='gzip',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), orjson.dumps({"summary": "要約", "transcript": "文字起こし" * 100}))
+
+
+class IngestVideosCommandTests(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.work_dir.name, "links.txt")
+        self.checkpoint_path = os.path.join(self.work_dir.name, "checkpoint.jsonl")
+        with open(self.input_path, "w", encoding="utf-8") as f:
+            for i in range(5):
+                f.write(f"https://www.youtube.com/watch?v=video{i:06d}\n")
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def run_command(self):
+        call_command("ingest_videos", self.input_path, checkpoint=self.checkpoint_path, workers=1, stdout=open(os.devnull, "w"))
+
+    def test_database_error_is_recorded_as_failed(self):
+        with mock.patch.object(YoutubePaidSummarizerAPI, 'summarize_video', return_value=(PAYLOAD, [], True)), \
+                mock.patch('summarizer_app.management.commands.ingest_videos.VideoSummary.store', side_effect=OperationalError("database is locked")):
+            self.run_command()
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            statuses = [json.loads(line)["status"] for line in f]
+        self.assertEqual(statuses, ["failed"] * 5)
+
+    def test_pending_videos_are_cancelled_on_error(self):
+        error_raised = threading.Event()
+        calls = []
+
+        def summarize_video(youtube_link, video_id):
+            calls.append(video_id)
+            if len(calls) > 1:
+                # 2件目以降は、1件目の結果の記録でコマンドが失敗するまで終わらないようにする
+                error_raised.wait(5)
+            return PAYLOAD, [], True
+
+        with mock.patch.object(YoutubePaidSummarizerAPI, 'summarize_video', side_effect=summarize_video), \
+                mock.patch('summarizer_app.management.commands.ingest_videos._Checkpoint.record', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.run_command()
+            error_raised.set()
+            # キャンセルされなければ、待つ間に残りの動画も処理される
+            time.sleep(0.2)
+        # 実行中だった1件を除き、残りの動画は処理されない
+        self.assertLessEqual(len(calls), 2)
+
+
+class ChunkBufferTests(SimpleTestCase):
+
+    def test_acquire_waits_until_released(self):
+        budget = MemoryBudget(100)
+        budget.acquire(80)
+        acquired = threading.Event()
+        waiter = threading.Thread(target=lambda: (budget.acquire(50), acquired.set()))
+        waiter.start()
+        self.assertFalse(acquired.wait(0.1))
+
+        budget.release(80)
+        self.assertTrue(acquired.wait(1))
+        waiter.join()
+        self.assertEqual(budget.used_bytes, 50)
+
+    def test_acquire_larger_than_capacity_is_capped(self):
+        budget = MemoryBudget(100)
+        self.assertEqual(budget.acquire(1000), 100)
+        self.assertEqual(budget.used_bytes, 100)
+
+    def test_growth_beyond_estimate_is_accounted(self):
+        budget = MemoryBudget(10 * 1024 * 1024)
+        chunk_buffer = ChunkBuffer(budget, 1000)
+        chunk_buffer.fill_from(io.BytesIO(b"x" * 200000))
+        self.assertEqual(len(chunk_buffer), 200000)
+        self.assertGreaterEqual(budget.used_bytes, 200000)
+
+        chunk_buffer.release()
+        self.assertEqual(budget.used_bytes, 0)
+
+    def test_release_is_idempotent(self):
+        budget = MemoryBudget(1000)
+        chunk_buffer = ChunkBuffer(budget, 500)
+        chunk_buffer.release()
+        chunk_buffer.release()
+        self.assertEqual(budget.used_bytes, 0)
+
+    def test_reader_seek_and_read(self):
+        chunk_buffer = ChunkBuffer(MemoryBudget(1000), 100)
+        chunk_buffer.fill_from(io.BytesIO(b"0123456789"))
+        with chunk_buffer.open() as reader:
+            self.assertEqual(reader.read(3), b"012")
+            self.assertEqual(reader.tell(), 3)
+            self.assertEqual(reader.seek(-2, io.SEEK_END), 8)
+            self.assertEqual(reader.read(), b"89")
+            self.assertEqual(reader.read(), b"")
+            self.assertEqual(reader.seek(2, io.SEEK_CUR), 12)
+            self.assertEqual(reader.read(1), b"")
+            reader.seek(0)
+            self.assertEqual(reader.read(), b"0123456789")
+            with self.assertRaises(ValueError):
+                reader.seek(0, 3)
+
+
+class SplitAudioInMemoryTests(SimpleTestCase):
+
+    def setUp(self):
+        self.audio_file = tempfile.NamedTemporaryFile(suffix=".mp3")
+        self.audio_file.write(b"\0" * 10000)
+        self.audio_file.flush()
+        self.budget = MemoryBudget(10 * 1024 * 1024)
+        self.budget_patch = mock.patch('summarizer_app.views.chunk_memory_budget', self.budget)
+        self.budget_patch.start()
+
+    def tearDown(self):
+        self.budget_patch.stop()
+        self.audio_file.close()
+
+    def split(self, script):
+        real_popen = subprocess.Popen
+        processes = []
+
+        def fake_popen(command, **kwargs):
+            # ffmpeg の代わりに script を実行する
+            process = real_popen([sys.executable, '-c', script], **kwargs)
+            processes.append(process)
+            return process
+
+        with mock.patch('summarizer_app.views.subprocess.Popen', side_effect=fake_popen):
+            chunks = list(YoutubePaidSummarizerAPI()._split_audio_ffmpeg_in_memory(self.audio_file.name, 10, 10))
+        return chunks, processes
+
+    def test_large_error_output_does_not_block(self):
+        script = "import sys; sys.stderr.write('Header missing\\n' * 100000); sys.stderr.flush(); sys.stdout.buffer.write(b'a' * 5000)"
+        chunks, _ = self.split(script)
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(len(chunks[0]["buffer"]), 5000)
+        chunks[0]["buffer"].release()
+        self.assertEqual(self.budget.used_bytes, 0)
+
+    def test_failed_read_kills_ffmpeg_and_releases_budget(self):
+        with mock.patch('summarizer_app.views.ChunkBuffer.fill_from', side_effect=OSError("read failed")):
+            with self.assertRaises(OSError):
+                self.split("import time; time.sleep(30)")
+        self.assertEqual(self.budget.used_bytes, 0)
+
+    def test_failed_chunk_is_skipped(self):
+        chunks, processes = self.split("import sys; sys.stderr.write('error'); sys.exit(1)")
+        self.assertEqual(chunks, [])
+        self.assertEqual(processes[0].returncode, 1)
+        self.assertEqual(self.budget.used_bytes, 0)
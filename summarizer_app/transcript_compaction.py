@@ -0,0 +1,220 @@
+import re
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+
+try:
+    import tiktoken
+except ImportError: # tiktoken が無い環境では文字数ベースの概算にフォールバックする
+    tiktoken = None
+
+
+# --- 定数 ---
+# 文字起こし結果に埋め込まれるエラーマーカー (例: [文字起こしエラー: ...], [不明な文字起こしエラー: ...])
+ERROR_MARKER_PATTERN = re.compile(r'\[(?:不明な)?文字起こしエラー:[^\]]*\]')
+
+# 意味を持たないフィラー。「あの」「まあ」単体は指示語・副詞としても使われるため、長音付きや読点が続く場合のみ除去する。
+# 語の一部 (例: "ねえー", "あーいう", "えーき") を削らないよう、前後が文頭・文末・空白・句読点の場合に限る
+FILLER_PATTERN = re.compile(
+    r'(?:^|(?<=[\s、。，,.！？!?「」『』（）()]))'
+    r'(?:えー+っと|えー+と|ええと|えっと|うーん+と|あのー+|あの(?=[、，,])|まあ(?=[、，,])|まぁ|うーん+|んー+|あー+|えー+|um+|uh+)'
+    r'(?=[\s、。，,.！？!?」』）)]|$)[、，,]?\s*',
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# 文単位に区切るための区切り文字 (区切り文字自体は直前の文に含める)
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[。！？!?\n])')
+
+# 句読点がほとんど無い Whisper の出力に備えて、1単位あたりの最大文字数
+MAX_UNIT_CHARS = 200
+
+# 連続して繰り返される単位列を検出する最大 n (n文のまとまりまで)
+MAX_REPEAT_NGRAM = 4
+
+# 同じ短いフレーズが1文内で4回以上連続する場合 (例: "はいはいはいはい") は1回にまとめる。
+# 数値 (例: "1000000", "0.3333333") や "ABABAB型" を書き換えないよう、数字・英字を含むフレーズは対象外にする
+REPEATED_PHRASE_PATTERN = re.compile(r'([^0-9０-９A-Za-zＡ-Ｚａ-ｚ]{2,30}?)\1{3,}')
+
+# 予算に合わせて間引いた箇所に挿入するマーカー
+OMISSION_MARKER = "（中略）"
+
+# 予算を超える場合に残す、連続した文のまとまりの最大数 (= 挿入する（中略）の最大数)
+MAX_KEPT_BLOCKS = 8
+
+# まとまり1つあたりの最小トークン数。予算が小さい場合はまとまりの数を減らし、文脈が細切れにならないようにする
+MIN_BLOCK_TOKENS = 300
+
+DEFAULT_TOKEN_BUDGET = 3000
+
+_fallback_warned = False
+_fallback_lock = threading.Lock()
+
+
+def clean_transcript(text):
+    """
+    文字起こしテキストからエラーマーカー・フィラー・繰り返し (Whisperの幻覚) を取り除く。
+    トークン予算とは無関係な処理なので、モデルごとに呼び直す必要はない。
+    """
+    if not text:
+        return ""
+
+    text = ERROR_MARKER_PATTERN.sub("", text)
+    text = FILLER_PATTERN.sub("", text)
+    text = REPEATED_PHRASE_PATTERN.sub(r'\1', text)
+
+    units = _split_units(text)
+    units = _collapse_repeated_runs(units)
+    return "".join(units).strip()
+
+
+def count_tokens(text, model):
+    """
+    指定モデルのトークナイザでテキストのトークン数を数える。
+    tiktoken やエンコーディングが利用できない場合は文字数で概算する (日本語では安全側の見積もり)。
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def fit_to_token_budget(text, model, token_budget=None):
+    """
+    テキストをモデルごとのトークン予算に収める。
+    予算を超える場合は先頭だけを残すのではなく、冒頭から始まる連続した文のまとまり (最大 MAX_KEPT_BLOCKS 個) を
+    動画全体に均等に配置して残し、間引いた箇所に（中略）を挿入する。
+    """
+    if token_budget is None:
+        token_budget = get_token_budget(model)
+
+    if count_tokens(text, model) <= token_budget:
+        return text
+
+    units = _split_units(text)
+    unit_tokens = [count_tokens(unit, model) for unit in units]
+    total_tokens = sum(unit_tokens) or 1
+    marker_tokens = count_tokens(OMISSION_MARKER, model)
+
+    # 各まとまりの後ろに（中略）が最大1つ入るので、その分を差し引いた残りをまとまりごとに均等に割り当てる
+    block_count = max(1, min(MAX_KEPT_BLOCKS, token_budget // (MIN_BLOCK_TOKENS + marker_tokens)))
+    block_allowance = max(token_budget - block_count * marker_tokens, 0) / block_count
+
+    block_starts = []
+    seen_tokens = 0
+    for index, tokens in enumerate(unit_tokens):
+        # 全体のトークン量を block_count 等分した位置から各まとまりを始める (最初のまとまりは必ず冒頭から)
+        while len(block_starts) < block_count and seen_tokens >= total_tokens * len(block_starts) / block_count:
+            block_starts.append(index)
+        seen_tokens += tokens
+
+    kept = [False] * len(units)
+    carry = 0
+    for start in block_starts:
+        allowance = block_allowance + carry
+        index = start
+        while index < len(units) and not kept[index] and unit_tokens[index] <= allowance:
+            kept[index] = True
+            allowance -= unit_tokens[index]
+            index += 1
+        carry = allowance # 使い切れなかった分は次のまとまりに回す
+
+    kept_parts = []
+    used_tokens = sum(tokens for tokens, keep in zip(unit_tokens, kept) if keep)
+    omitted = False
+    for unit, keep in zip(units, kept):
+        if not keep:
+            omitted = True
+            continue
+        if omitted and used_tokens + marker_tokens <= token_budget:
+            kept_parts.append(OMISSION_MARKER)
+            used_tokens += marker_tokens
+        omitted = False
+        kept_parts.append(unit)
+
+    if omitted and used_tokens + marker_tokens <= token_budget:
+        kept_parts.append(OMISSION_MARKER)
+
+    return "".join(kept_parts).strip()
+
+
+def get_token_budget(model):
+    """
+    settings.TRANSCRIPT_TOKEN_BUDGETS からモデルごとの文字起こしトークン予算を取得する。
+    """
+    budgets = getattr(settings, 'TRANSCRIPT_TOKEN_BUDGETS', {})
+    return budgets.get(model, getattr(settings, 'TRANSCRIPT_TOKEN_BUDGET_DEFAULT', DEFAULT_TOKEN_BUDGET))
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model):
+    """
+    モデル名に対応する tiktoken エンコーディングを取得する (プロセス内でキャッシュ)。
+    """
+    global _fallback_warned
+    if tiktoken is not None:
+        try:
+            try:
+                return tiktoken.encoding_for_model(model)
+            except KeyError:
+                return tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # エンコーディングファイルのダウンロードに失敗した場合など
+            reason = str(e)
+    else:
+        reason = "tiktoken がインストールされていません"
+
+    with _fallback_lock:
+        if not _fallback_warned:
+            print(f"警告: トークナイザを読み込めないため文字数でトークン数を概算します: {reason}")
+            _fallback_warned = True
+    return None
+
+
+def _split_units(text):
+    """
+    テキストを文単位に分割する。句読点が無く長すぎる単位は MAX_UNIT_CHARS ごとに分割する。
+    """
+    units = []
+    for sentence in SENTENCE_SPLIT_PATTERN.split(text):
+        if not sentence:
+            continue
+        for start in range(0, len(sentence), MAX_UNIT_CHARS):
+            units.append(sentence[start:start + MAX_UNIT_CHARS])
+    return units
+
+
+def _collapse_repeated_runs(units):
+    """
+    連続して繰り返される n 単位 (n <= MAX_REPEAT_NGRAM) のまとまりを1回分に縮める。
+    例: [A, B, A, B, A, B, C] -> [A, B, C]
+    """
+    normalized = [unit.strip() for unit in units]
+    result = []
+    i = 0
+    while i < len(units):
+        if not normalized[i]:
+            result.append(units[i])
+            i += 1
+            continue
+
+        collapsed = False
+        for n in range(1, MAX_REPEAT_NGRAM + 1):
+            block = normalized[i:i + n]
+            if len(block) < n:
+                break
+            repeats = 1
+            while normalized[i + repeats * n:i + (repeats + 1) * n] == block:
+                repeats += 1
+            if repeats > 1:
+                result.extend(units[i:i + n])
+                i += repeats * n
+                collapsed = True
+                break
+
+        if not collapsed:
+            result.append(units[i])
+            i += 1
+    return result
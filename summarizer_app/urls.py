@@ -1,6 +1,7 @@
 from django.urls import path
-from .views import YoutubePaidSummarizerAPI # クラス名を変更
+from .views import UsageAPI, YoutubePaidSummarizerAPI # クラス名を変更
 
 urlpatterns = [
     path('summarize_paid_audio/', YoutubePaidSummarizerAPI.as_view(), name='summarize_youtube_paid_audio'),
+    path('usage/', UsageAPI.as_view(), name='usage'),
 ]
\ No newline at end of file
@@ -1,6 +1,7 @@
 from django.shortcuts import render
 import os
 import re
+import shlex
 import subprocess
 import tempfile
 import shutil
@@ -11,30 +12,35 @@ import math
 # pydubは分割処理では不要になったため、コメントアウトまたは削除を検討
 # from pydub import AudioSegment 
 
-import openai
-from openai import OpenAI
-
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from googleapiclient.discovery import build
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+
+# YouTube Data API / OpenAI API のクライアントは clients.py で初回使用時に作成され、プロセス内で使い回される
+from .chunk_buffers import ChunkBuffer, chunk_memory_budget
+from .clients import get_openai_client, report_openai_failure, report_openai_success, youtube_client
+from .models import VideoSummary
+from .quotas import QuotaExceeded, check_audio_quota, check_token_quota, get_client_key, get_usage, record_tokens, release_audio_seconds, reserve_audio_seconds
+from .response_shaping import ResponseShapingError, parse_shaping_params, shape_response
+from .scheduling import completion_scheduler, transcription_scheduler
+from .transcript_compaction import clean_transcript, count_tokens, fit_to_token_budget
+
 
-# --- YouTube Data API Client Initialization ---
-youtube = build('youtube', 'v3', developerKey=settings.YOUTUBE_API_KEY)
+class SummarizationError(Exception):
+    """
+    要約処理のいずれかのステップが失敗した場合に送出される。
+    body にはクライアントに返すエラー内容、status_code にはHTTPステータスコードを保持する。
+    """
 
-# --- OpenAI API Client Initialization ---
-openai_client = None
-try:
-    print("OpenAI API クライアントを初期化中...")
-    openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
-    print("OpenAI API クライアントの初期化に成功しました。")
-except Exception as e:
-    print(f"OpenAI API クライアントの初期化に失敗しました: {e}")
-    print(f"トレースバック:\n{traceback.format_exc()}")
-    openai_client = None
+    def __init__(self, body, status_code):
+        super().__init__(body.get("error"))
+        self.body = body
+        self.status_code = status_code
 
 
 class YoutubePaidSummarizerAPI(APIView):
@@ -45,7 +51,9 @@ class YoutubePaidSummarizerAPI(APIView):
 
     # --- 定数 ---
     CHUNK_LENGTH_SECONDS = 60 * 2 # 2分 = 120秒ごとに分割
-    MAX_WHISPER_WORKERS = 10 # 並行して実行するWhisper API呼び出しの最大数
+    BATCH_CLIENT_KEY = "batch" # リクエスト以外 (ingest_videos コマンドなど) から実行する場合のクライアントキー
+    SUMMARY_MODEL = "gpt-3.5-turbo" # 要約に使用するモデル
+    PROBLEMS_MODEL = "gpt-4" # 練習問題の生成に使用するモデル
 
     def post(self, request, *args, **kwargs):
         youtube_link = request.data.get('link')
@@ -59,69 +67,98 @@ class YoutubePaidSummarizerAPI(APIView):
             print(f"エラー: 無効なYouTubeリンクです。動画IDを抽出できませんでした: {youtube_link}")
             return Response({"error": "無効なYouTubeリンクです。動画IDを抽出できませんでした。"}, status=status.HTTP_400_BAD_REQUEST)
 
+        try:
+            shaping = parse_shaping_params(request.query_params)
+        except ResponseShapingError as e:
+            print(f"エラー: 不正なクエリパラメータです: {e}")
+            return Response({"error": "不正なクエリパラメータです。", "detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            cached_summary = VideoSummary.objects.filter(video_id=video_id).first()
+        except DatabaseError as e:
+            # テーブルが未作成 (migrate 未実行) などでDBを読めない場合は、保存済みの要約が無いものとして処理を続ける
+            print(f"警告: 保存済みの要約を取得できませんでした ({video_id}): {e}")
+            cached_summary = None
+        if cached_summary is not None:
+            print(f"保存済みの要約を返します: {video_id}")
+            return Response(shape_response(cached_summary.to_payload(), cached_summary.transcript_segments, shaping), status=status.HTTP_200_OK)
+
+        try:
+            payload, transcript_segments, complete = self.summarize_video(
+                youtube_link, video_id, client_key=get_client_key(request), enforce_quota=True
+            )
+        except SummarizationError as e:
+            return Response(e.body, status=e.status_code)
+
+        if complete:
+            try:
+                VideoSummary.store(video_id, youtube_link, payload, transcript_segments)
+            except DatabaseError as e:
+                # 保存に失敗しても要約自体は完了しているので、次回は再生成になるが結果は返す
+                print(f"警告: 要約の保存に失敗しました ({video_id}): {e}")
+                print(f"トレースバック:\n{traceback.format_exc()}")
+
+        return Response(shape_response(payload, transcript_segments, shaping), status=status.HTTP_200_OK)
+
+    def summarize_video(self, youtube_link, video_id, client_key=BATCH_CLIENT_KEY, enforce_quota=False):
+        """
+        動画情報の取得・音声ダウンロード・文字起こし・要約・練習問題の生成を順に実行する。
+        (レスポンス用のペイロード, 文字起こしセグメント, 全ステップが成功したか) を返し、
+        失敗した場合は SummarizationError を送出する。ingest_videos コマンドからも使用される。
+        Whisper / GPT の呼び出しは client_key ごとに公平にスケジューリングされ、
+        enforce_quota=True の場合は client_key の利用量の上限も確認する。
+        """
         temp_dir = None
         downloaded_audio_filepath = None
+        # 予約した音声の利用量 (秒, 時間枠)。結果を返せずに失敗した場合に払い戻す
+        audio_reservation = None
 
         try:
             temp_dir = tempfile.mkdtemp(dir=settings.MEDIA_ROOT)
             print(f"一時ディレクトリを作成しました: {temp_dir}")
 
             # 1. Get video information using YouTube Data API.
-            print("ステップ1: YouTube Data API で動画情報の取得を開始します。")
-            try:
-                video_response = youtube.videos().list(
-                    part='snippet,contentDetails', # contentDetails を追加して動画の長さを取得
-                    id=video_id
-                ).execute()
+            # 動画情報の取得は音声ダウンロードと並行して実行し、APIの往復時間を待たずにダウンロードを始める
+            print("ステップ1: YouTube Data API で動画情報の取得を開始します (音声ダウンロードと並行して実行)。")
+            metadata_executor = ThreadPoolExecutor(max_workers=1)
+            metadata_future = metadata_executor.submit(self._fetch_video_metadata, video_id)
+            metadata_executor.shutdown(wait=False)
 
-                if not video_response.get('items'):
-                    print(f"エラー: YouTube Data API: 指定されたIDの動画が見つかりません: {video_id}")
-                    return Response({"error": "指定されたIDの動画が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+            if enforce_quota:
+                try:
+                    check_audio_quota(client_key)
+                except QuotaExceeded as e:
+                    print(f"エラー: {client_key} の利用量が上限を超えています: {e}")
+                    raise SummarizationError({"error": str(e), "usage": e.usage}, status.HTTP_429_TOO_MANY_REQUESTS)
 
-                video_item = video_response['items'][0]
-                video_snippet = video_item['snippet']
-                video_content_details = video_item['contentDetails']
+            # 2. Download audio from YouTube video locally using yt-dlp, directly to mp3.
+            print("ステップ2: yt-dlp で音声ダウンロードを開始します (MP3形式)。")
+            download_error = None
+            try:
+                downloaded_audio_filepath = self._download_audio(youtube_link, video_id, temp_dir)
+            except Exception as e:
+                download_error = e
 
-                title = video_snippet.get('title', 'N/A')
-                description = video_snippet.get('description', 'N/A')
-                # 動画の長さを取得 (ISO 8601形式のDurationを秒に変換)
-                duration_iso = video_content_details.get('duration')
-                total_duration_seconds = self._parse_iso8601_duration(duration_iso) if duration_iso else 0
+            # 動画が存在しない場合などは、ダウンロードの失敗よりも動画情報の取得結果を優先して返す
+            try:
+                video_metadata = metadata_future.result()
+                if video_metadata is None:
+                    print(f"エラー: YouTube Data API: 指定されたIDの動画が見つかりません: {video_id}")
+                    raise SummarizationError({"error": "指定されたIDの動画が見つかりません。"}, status.HTTP_404_NOT_FOUND)
 
-                print(f"動画情報取得完了。タイトル: {title}, 長さ: {total_duration_seconds}秒")
+                title = video_metadata['title']
+                description = video_metadata['description']
+                print(f"動画情報取得完了。タイトル: {title}")
+            except SummarizationError:
+                raise
             except Exception as e:
                 print(f"ステップ1エラー: YouTube Data API で動画情報の取得中にエラーが発生しました: {e}")
                 print(f"トレースバック:\n{traceback.format_exc()}")
-                return Response({"error": "動画情報の取得に失敗しました。", "detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                raise SummarizationError({"error": "動画情報の取得に失敗しました。", "detail": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            # 2. Download audio from YouTube video locally using yt-dlp, directly to mp3.
-            print("ステップ2: yt-dlp で音声ダウンロードを開始します (MP3形式)。")
             try:
-                downloaded_audio_extension = 'mp3'
-                downloaded_audio_filename = f"{video_id}_downloaded_audio.{downloaded_audio_extension}"
-                downloaded_audio_filepath = os.path.join(temp_dir, downloaded_audio_filename)
-
-                # yt-dlpのオーディオ品質オプションを追加（任意）
-                # '192K' など、より低いビットレートを指定することでダウンロードと変換を高速化できる可能性があります
-                yt_dlp_command = [
-                    'yt-dlp',
-                    '-f', 'bestaudio',
-                    '--extract-audio',
-                    '--audio-format', downloaded_audio_extension,
-                    # '--audio-quality', '128K', # 必要であれば追加
-                    '-o', downloaded_audio_filepath,
-                    youtube_link,
-                    '--force-overwrites'
-                ]
-
-                print(f"   yt-dlp コマンド実行: {' '.join(yt_dlp_command)}")
-                print(f"   subprocess.run 実行時のPATH (yt-dlp): {os.environ.get('PATH')}")
-                # capture_output=False にすると、yt-dlpの進捗がリアルタイムで表示される
-                subprocess.run(yt_dlp_command, check=True, capture_output=False)
-
-                if not os.path.exists(downloaded_audio_filepath) or os.path.getsize(downloaded_audio_filepath) == 0:
-                    raise Exception(f"yt-dlp がオーディオファイルをダウンロードできなかったか、空のファイルです: {downloaded_audio_filepath}")
-
+                if download_error is not None:
+                    raise download_error
                 print(f"音声ダウンロード完了: {downloaded_audio_filepath}")
             except subprocess.CalledProcessError as e:
                 error_output = e.stderr.decode('utf-8') if e.stderr else "(エラー出力なし)"
@@ -129,152 +166,255 @@ class YoutubePaidSummarizerAPI(APIView):
                 print(f"   リターンコード: {e.returncode}")
                 print(f"   標準エラー出力:\n{error_output}")
                 print(f"トレースバック:\n{traceback.format_exc()}")
-                return Response({"error": "動画のダウンロードに失敗しました。", "detail": f"yt-dlp コマンド実行エラー: {e.cmd}. エラー出力: {error_output}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                raise SummarizationError({"error": "動画のダウンロードに失敗しました。", "detail": f"yt-dlp コマンド実行エラー: {e.cmd}. エラー出力: {error_output}"}, status.HTTP_500_INTERNAL_SERVER_ERROR)
             except FileNotFoundError as e:
                 print(f"ステップ2エラー: yt-dlp 実行ファイルが見つかりません: {e.filename}")
                 print(f"   詳細: {e.strerror}")
                 print(f"トレースバック:\n{traceback.format_exc()}")
-                return Response({"error": "動画のダウンロードに失敗しました。", "detail": f"yt-dlp 実行ファイルが見つかりません: {e.filename}. PATHが正しく設定されているか確認してください。"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                raise SummarizationError({"error": "動画のダウンロードに失敗しました。", "detail": f"yt-dlp 実行ファイルが見つかりません: {e.filename}. PATHが正しく設定されているか確認してください。"}, status.HTTP_500_INTERNAL_SERVER_ERROR)
             except Exception as e:
                 print(f"ステップ2エラー: 音声ダウンロード中に予期せぬエラーが発生しました: {e}")
                 print(f"トレースバック:\n{traceback.format_exc()}")
-                return Response({"error": "音声ダウンロード中にエラーが発生しました。", "detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                raise SummarizationError({"error": "音声ダウンロード中にエラーが発生しました。", "detail": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            # チャンク分割は実際にダウンロードした音声の長さに基づいて行う
+            # (ライブ配信やプレミア公開の動画ではAPIの duration が0になるため)
+            total_duration_seconds = self._probe_audio_duration(downloaded_audio_filepath)
+            if total_duration_seconds is None:
+                total_duration_seconds = video_metadata['duration_seconds']
+                print(f"   警告: ffprobe で音声の長さを取得できなかったため、APIの値 ({total_duration_seconds}秒) を使用します。")
+            print(f"   音声の長さ: {total_duration_seconds}秒")
+
+            if enforce_quota:
+                try:
+                    audio_reservation = (total_duration_seconds, reserve_audio_seconds(client_key, total_duration_seconds))
+                except QuotaExceeded as e:
+                    print(f"エラー: {client_key} の利用量が上限を超えています: {e}")
+                    raise SummarizationError({"error": str(e), "usage": e.usage}, status.HTTP_429_TOO_MANY_REQUESTS)
 
             # ダウンロードされたMP3ファイルを文字起こしに使用
             converted_audio_filepath = downloaded_audio_filepath
 
             # 3. Split audio into chunks and transcribe using OpenAI Whisper API in parallel.
             print("ステップ3: 音声ファイルをチャンクに分割し、OpenAI Whisper API で並行して文字起こしを開始します。")
+            openai_client = get_openai_client()
             if openai_client is None:
                 print("エラー: OpenAI API クライアントがロードされていません。")
-                return Response({"error": "OpenAI API クライアントがロードされていません。設定を確認してください。"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                raise SummarizationError({"error": "OpenAI API クライアントがロードされていません。設定を確認してください。"}, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
             transcript_text = ""
+            transcript_segments = []
             try:
-                # 音声ファイルをチャンクに分割（ffmpeg直接呼び出し）
+                # 音声ファイルをチャンクに分割（ffmpeg直接呼び出し）し、
+                # 全リクエスト共有のワーカーに、クライアントごとに公平に割り当てて並行して文字起こしを実行する
                 print(f"   音声を {self.CHUNK_LENGTH_SECONDS} 秒ごとに分割中...")
-                chunk_files = self._split_audio_ffmpeg( # _split_audio から _split_audio_ffmpeg に変更
-                    audio_file_path=converted_audio_filepath,
-                    total_duration_seconds=total_duration_seconds, # 動画の総時間を渡す
-                    chunk_length_seconds=self.CHUNK_LENGTH_SECONDS,
-                    output_dir=temp_dir
-                )
+                if settings.TRANSCRIPTION_CHUNK_STORAGE == 'memory':
+                    # チャンクはディスクに書かずメモリ上に作成し、できたものから順に文字起こしに回す
+                    # (メモリ予算に空きが無い間は次のチャンクの作成を待つ)
+                    chunk_files = []
+                    future_to_chunk = {}
+                    for chunk_info in self._split_audio_ffmpeg_in_memory(
+                        audio_file_path=converted_audio_filepath,
+                        total_duration_seconds=total_duration_seconds,
+                        chunk_length_seconds=self.CHUNK_LENGTH_SECONDS
+                    ):
+                        chunk_files.append(chunk_info)
+                        future_to_chunk[transcription_scheduler.submit(client_key, self._transcribe_audio_chunk_parallel, chunk_info)] = chunk_info
+                else:
+                    chunk_files = self._split_audio_ffmpeg( # _split_audio から _split_audio_ffmpeg に変更
+                        audio_file_path=converted_audio_filepath,
+                        total_duration_seconds=total_duration_seconds, # 動画の総時間を渡す
+                        chunk_length_seconds=self.CHUNK_LENGTH_SECONDS,
+                        output_dir=temp_dir
+                    )
+                    future_to_chunk = {
+                        transcription_scheduler.submit(client_key, self._transcribe_audio_chunk_parallel, chunk_info): chunk_info
+                        for chunk_info in chunk_files
+                    }
                 print(f"   {len(chunk_files)} 個のチャンクを作成しました。")
 
                 if not chunk_files:
                     print("警告: 分割された音声チャンクがありません。文字起こしできません。")
                     transcript_text = ""
                 else:
-                    # 並行して文字起こしを実行
-                    transcription_results = [None] * len(chunk_files) # 順序を保持するリスト
-
-                    with ThreadPoolExecutor(max_workers=self.MAX_WHISPER_WORKERS) as executor:
-                        future_to_chunk = {
-                            executor.submit(self._transcribe_audio_chunk_parallel, chunk_info): chunk_info
-                            for chunk_info in chunk_files
-                        }
-
-                        for future in as_completed(future_to_chunk):
-                            chunk_info = future_to_chunk[future]
-                            try:
-                                result = future.result()
-                                if "error" in result:
-                                    print(f"   チャンク {result['index']} の文字起こし中にエラーが発生しました: {result['error']}")
-                                    transcription_results[result["index"]] = f"[文字起こしエラー: {result['error']}]"
-                                else:
-                                    transcription_results[result["index"]] = result["text"]
-                            except Exception as exc:
-                                print(f"   チャンク {chunk_info['index']} の処理中に予期せぬ例外が発生しました: {exc}")
-                                transcription_results[chunk_info["index"]] = f"[不明な文字起こしエラー: {exc}]"
+                    # 順序を保持するリスト (作成に失敗したチャンクがあっても添字が範囲内に収まるよう、最大のインデックスに合わせる)
+                    transcription_results = [None] * (max(chunk_info["index"] for chunk_info in chunk_files) + 1)
+
+                    for future in as_completed(future_to_chunk):
+                        chunk_info = future_to_chunk[future]
+                        try:
+                            result = future.result()
+                            if "error" in result:
+                                print(f"   チャンク {result['index']} の文字起こし中にエラーが発生しました: {result['error']}")
+                                transcription_results[result["index"]] = f"[文字起こしエラー: {result['error']}]"
+                            else:
+                                transcription_results[result["index"]] = result["text"]
+                        except Exception as exc:
+                            print(f"   チャンク {chunk_info['index']} の処理中に予期せぬ例外が発生しました: {exc}")
+                            transcription_results[chunk_info["index"]] = f"[不明な文字起こしエラー: {exc}]"
 
                     # 全てのチャンクの文字起こし結果を結合
                     full_transcript_parts = [text for text in transcription_results if text is not None]
                     transcript_text = "\n".join(full_transcript_parts).strip()
+                    transcript_segments = self._build_transcript_segments(chunk_files, transcription_results, total_duration_seconds)
 
                 print("文字起こし完了。")
 
                 if not transcript_text:
                     print("警告: 音声から文字起こしテキストを取得できませんでした。")
-                    return Response({
+                    return {
                         "title": title,
                         "description": description,
                         "transcript": "",
                         "summary": "動画の音声から文字起こしテキストを取得できませんでした。要約を生成できません。",
                         "practice_problems": "文字起こしテキストがないため、練習問題は生成できません。",
-                    }, status=status.HTTP_200_OK)
+                    }, transcript_segments, False
 
             except Exception as e:
                 print(f"ステップ3エラー: Whisper API で文字起こし中にエラーが発生しました: {e}")
                 print(f"トレースバック:\n{traceback.format_exc()}")
-                return Response({"error": "音声の文字起こしに失敗しました。", "detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                raise SummarizationError({"error": "音声の文字起こしに失敗しました。", "detail": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            # プロンプトに埋め込む前に、繰り返し・フィラー・エラーマーカーを除去してトークン予算内に収める
+            # (レスポンスの transcript には元の文字起こしテキストをそのまま返す)
+            cleaned_transcript_text = clean_transcript(transcript_text)
+            print(f"   文字起こしテキストを圧縮しました: {len(transcript_text)}文字 -> {len(cleaned_transcript_text)}文字")
 
             # 4. Generate summary using OpenAI API.
             print("ステップ4: OpenAI API で要約を開始します。")
             if openai_client is None:
                 print("エラー: OpenAI API クライアントがロードされていません。")
-                return Response({"error": "OpenAI API クライアントがロードされていません。設定を確認してください。"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                raise SummarizationError({"error": "OpenAI API クライアントがロードされていません。設定を確認してください。"}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+            if enforce_quota:
+                try:
+                    check_token_quota(client_key)
+                except QuotaExceeded as e:
+                    print(f"エラー: {client_key} の利用量が上限を超えています: {e}")
+                    raise SummarizationError({"error": str(e), "usage": e.usage}, status.HTTP_429_TOO_MANY_REQUESTS)
             try:
-                prompt_summary = f"以下のYouTube動画の文字起こしデータとタイトルに基づいて、日本語で要点を簡潔にまとめてください。これを見たときにどのような分野でどのようなことをやっているのか読者がわかるようにまとめてください。数学や物理学の問題の時はその手順を細かく解説してください。\n\n動画タイトル: {title}\n\n文字起こしデータ:\n{transcript_text}\n\n要約:"
+                summary_transcript_text = self._fit_transcript_for_model(cleaned_transcript_text, self.SUMMARY_MODEL)
+                prompt_summary = f"以下のYouTube動画の文字起こしデータとタイトルに基づいて、日本語で要点を簡潔にまとめてください。これを見たときにどのような分野でどのようなことをやっているのか読者がわかるようにまとめてください。数学や物理学の問題の時はその手順を細かく解説してください。\n\n動画タイトル: {title}\n\n文字起こしデータ:\n{summary_transcript_text}\n\n要約:"
                 print("   OpenAI API (要約) リクエスト送信中...")
-                response_summary_openai = openai_client.chat.completions.create(
-                    model="gpt-3.5-turbo",
+                response_summary_openai = completion_scheduler.submit(
+                    client_key,
+                    openai_client.chat.completions.create,
+                    model=self.SUMMARY_MODEL,
                     messages=[
                         {"role": "system", "content": "あなたは動画の内容を要約して参考書を作るアシスタントです。"},
                         {"role": "user", "content": prompt_summary}
                     ],
                     max_tokens=1000,
                     temperature=0.7,
-                )
+                ).result()
+                report_openai_success()
+                record_tokens(client_key, self._total_tokens(response_summary_openai))
                 summary = response_summary_openai.choices[0].message.content.strip()
                 print("要約完了。")
             except Exception as e:
+                report_openai_failure(e)
                 print(f"ステップ4エラー: OpenAI API で要約生成中にエラーが発生しました: {e}")
                 print(f"トレースバック:\n{traceback.format_exc()}")
-                return Response({"error": "要約の生成に失敗しました。", "detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                raise SummarizationError({"error": "要約の生成に失敗しました。", "detail": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
             # 5. Generate practice problems using OpenAI API.
             print("ステップ5: OpenAI API で練習問題の生成を開始します。")
             practice_problems = "生成できませんでした。"
+            problems_generated = False
             if openai_client:
-                prompt_problems = f"以下のYouTube動画の文字起こしデータとタイトルを参考に、数学や物理の動画であれば、その内容に基づいた練習問題を日本語で5問作成してください。解答も一緒に提供してください。解答を作成する際に途中の導出方法も細かく記述してください。その他の分野で知識問題を作成するときは動画に出てきた分野の範囲において穴埋め問題を作成してください。その答えも一緒に提供してください。\n\n動画タイトル: {title}\n\n文字起こしデータ:\n{transcript_text}\n\n練習問題と解答:"
+                problems_transcript_text = self._fit_transcript_for_model(cleaned_transcript_text, self.PROBLEMS_MODEL)
+                prompt_problems = f"以下のYouTube動画の文字起こしデータとタイトルを参考に、数学や物理の動画であれば、その内容に基づいた練習問題を日本語で5問作成してください。解答も一緒に提供してください。解答を作成する際に途中の導出方法も細かく記述してください。その他の分野で知識問題を作成するときは動画に出てきた分野の範囲において穴埋め問題を作成してください。その答えも一緒に提供してください。\n\n動画タイトル: {title}\n\n文字起こしデータ:\n{problems_transcript_text}\n\n練習問題と解答:"
                 print("   OpenAI API (練習問題) リクエスト送信中...")
                 try:
-                    response_problems_openai = openai_client.chat.completions.create(
-                        model="gpt-4",
+                    response_problems_openai = completion_scheduler.submit(
+                        client_key,
+                        openai_client.chat.completions.create,
+                        model=self.PROBLEMS_MODEL,
                         messages=[
                             {"role": "system", "content": "あなたは動画内容から練習問題を作成するアシスタントです。"},
                             {"role": "user", "content": prompt_problems}
                         ],
                         max_tokens=1500,
                         temperature=0.7,
-                    )
+                    ).result()
+                    report_openai_success()
+                    record_tokens(client_key, self._total_tokens(response_problems_openai))
                     practice_problems = response_problems_openai.choices[0].message.content.strip()
+                    problems_generated = True
                     print("練習問題の生成完了。")
                 except Exception as problem_e:
+                    report_openai_failure(problem_e)
                     print(f"ステップ5エラー: 練習問題の生成中にエラーが発生しました: {problem_e}")
                     print(f"トレースバック:\n{traceback.format_exc()}")
                     practice_problems = f"練習問題の生成中にエラーが発生しました: {problem_e}"
             else:
                 print("警告: OpenAI API クライアントが利用できないため、練習問題は生成されません。")
 
-            return Response({
+            return {
                 "title": title,
                 "description": description,
                 "transcript": transcript_text,
                 "summary": summary,
                 "practice_problems": practice_problems
-            }, status=status.HTTP_200_OK)
+            }, transcript_segments, problems_generated
 
+        except SummarizationError:
+            self._release_audio_reservation(client_key, audio_reservation)
+            raise
         except Exception as e:
+            self._release_audio_reservation(client_key, audio_reservation)
             traceback_str = traceback.format_exc()
             print(f"API処理中に予期せぬクリティカルエラーが発生しました: {e}")
             print(f"トレースバック:\n{traceback_str}")
-            return Response({"error": "処理中に予期せぬクリティカルエラーが発生しました。", "detail": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            raise SummarizationError({"error": "処理中に予期せぬクリティカルエラーが発生しました。", "detail": str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
         finally:
             if temp_dir and os.path.exists(temp_dir):
                 print(f"一時ディレクトリを削除します: {temp_dir}")
                 shutil.rmtree(temp_dir)
 
+    def _release_audio_reservation(self, client_key, audio_reservation):
+        """
+        要約を返せずに失敗した場合、予約済みの音声の利用量を払い戻す
+        """
+        if audio_reservation is None:
+            return
+        seconds, window_start = audio_reservation
+        release_audio_seconds(client_key, seconds, window_start)
+        print(f"   {client_key} の音声の利用量 ({seconds}秒) を払い戻しました。")
+
+    def _build_transcript_segments(self, chunk_files, transcription_results, total_duration_seconds):
+        """
+        チャンクごとの文字起こし結果を、開始・終了時刻付きのセグメントのリストにする
+        """
+        segments = []
+        for chunk_info in chunk_files:
+            text = transcription_results[chunk_info["index"]]
+            if text is None:
+                continue
+            start_seconds = chunk_info["index"] * self.CHUNK_LENGTH_SECONDS
+            segments.append({
+                "index": chunk_info["index"],
+                "start_seconds": start_seconds,
+                "end_seconds": min(start_seconds + self.CHUNK_LENGTH_SECONDS, total_duration_seconds),
+                "text": text,
+            })
+        return segments
+
+    def _total_tokens(self, completion):
+        """
+        Chat Completions のレスポンスから使用トークン数を取り出す
+        """
+        usage = getattr(completion, "usage", None)
+        return getattr(usage, "total_tokens", 0) or 0
+
+    def _fit_transcript_for_model(self, transcript_text, model):
+        """
+        文字起こしテキストをモデルごとのトークン予算 (settings.TRANSCRIPT_TOKEN_BUDGETS) に収める
+        """
+        fitted_text = fit_to_token_budget(transcript_text, model)
+        if fitted_text != transcript_text:
+            print(f"   {model} のトークン予算に合わせて文字起こしテキストを間引きました: {count_tokens(transcript_text, model)} -> {count_tokens(fitted_text, model)} トークン")
+        return fitted_text
+
     def _extract_video_id(self, youtube_link):
         """
         YouTubeリンクから動画IDを抽出する
@@ -293,6 +433,98 @@ class YoutubePaidSummarizerAPI(APIView):
 
         return None
 
+    def _fetch_video_metadata(self, video_id):
+        """
+        YouTube Data API で動画のタイトル・説明・長さを取得する。動画が見つからない場合は None を返す。
+        取得結果は ETag と一緒にキャッシュし、次回からは If-None-Match で再検証する (変更が無ければ304が返る)。
+        """
+        from googleapiclient.errors import HttpError
+
+        cache_key = f"youtube_metadata:{video_id}"
+        cached = cache.get(cache_key)
+
+        with youtube_client() as youtube:
+            metadata_request = youtube.videos().list(
+                part='snippet,contentDetails', # contentDetails を追加して動画の長さを取得
+                id=video_id
+            )
+            if cached:
+                metadata_request.headers['If-None-Match'] = cached['etag']
+            try:
+                video_response = metadata_request.execute()
+            except HttpError as e:
+                if cached and e.resp.status == 304:
+                    print(f"   動画情報は更新されていないため、キャッシュを使用します: {video_id}")
+                    cache.touch(cache_key, settings.YOUTUBE_METADATA_CACHE_SECONDS)
+                    return cached['metadata']
+                raise
+
+        if not video_response.get('items'):
+            return None
+
+        video_item = video_response['items'][0]
+        video_snippet = video_item['snippet']
+        video_content_details = video_item['contentDetails']
+        # 動画の長さを取得 (ISO 8601形式のDurationを秒に変換)
+        duration_iso = video_content_details.get('duration')
+        metadata = {
+            "title": video_snippet.get('title', 'N/A'),
+            "description": video_snippet.get('description', 'N/A'),
+            "duration_seconds": self._parse_iso8601_duration(duration_iso) if duration_iso else 0,
+        }
+
+        if video_response.get('etag'):
+            cache.set(cache_key, {"etag": video_response['etag'], "metadata": metadata}, settings.YOUTUBE_METADATA_CACHE_SECONDS)
+        return metadata
+
+    def _download_audio(self, youtube_link, video_id, temp_dir):
+        """
+        yt-dlp で動画の音声をMP3としてダウンロードし、ファイルパスを返す
+        """
+        downloaded_audio_extension = 'mp3'
+        downloaded_audio_filename = f"{video_id}_downloaded_audio.{downloaded_audio_extension}"
+        downloaded_audio_filepath = os.path.join(temp_dir, downloaded_audio_filename)
+
+        # yt-dlpのオーディオ品質オプションを追加（任意）
+        # '192K' など、より低いビットレートを指定することでダウンロードと変換を高速化できる可能性があります
+        yt_dlp_command = shlex.split(settings.YT_DLP_COMMAND) + [
+            '-f', 'bestaudio',
+            '--extract-audio',
+            '--audio-format', downloaded_audio_extension,
+            # '--audio-quality', '128K', # 必要であれば追加
+            '-o', downloaded_audio_filepath,
+            youtube_link,
+            '--force-overwrites'
+        ]
+
+        print(f"   yt-dlp コマンド実行: {' '.join(yt_dlp_command)}")
+        print(f"   subprocess.run 実行時のPATH (yt-dlp): {os.environ.get('PATH')}")
+        # capture_output=False にすると、yt-dlpの進捗がリアルタイムで表示される
+        subprocess.run(yt_dlp_command, check=True, capture_output=False)
+
+        if not os.path.exists(downloaded_audio_filepath) or os.path.getsize(downloaded_audio_filepath) == 0:
+            raise Exception(f"yt-dlp がオーディオファイルをダウンロードできなかったか、空のファイルです: {downloaded_audio_filepath}")
+
+        return downloaded_audio_filepath
+
+    def _probe_audio_duration(self, audio_file_path):
+        """
+        ffprobe で音声ファイルの長さ (秒、切り上げ) を取得する。取得できなかった場合は None を返す。
+        """
+        ffprobe_command = [
+            'ffprobe',
+            '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'default=noprint_wrappers=1:nokey=1',
+            audio_file_path
+        ]
+        try:
+            completed = subprocess.run(ffprobe_command, check=True, capture_output=True, text=True)
+            return math.ceil(float(completed.stdout.strip()))
+        except (subprocess.CalledProcessError, FileNotFoundError, ValueError) as e:
+            print(f"警告: ffprobe で音声の長さを取得できませんでした: {e}")
+            return None
+
     def _parse_iso8601_duration(self, duration_str):
         """
         ISO 8601形式の期間文字列 (例: PT1H2M3S) を秒数に変換する
@@ -373,40 +605,134 @@ class YoutubePaidSummarizerAPI(APIView):
 
         return chunks
 
+    def _split_audio_ffmpeg_in_memory(self, audio_file_path, total_duration_seconds, chunk_length_seconds):
+        """
+        ffmpegの出力をパイプで受け取り、音声チャンクをメモリ上 (ChunkBuffer) に作成して1つずつ返すジェネレータ。
+        チャンクの作成前に共有のメモリ予算を確保するため、予算に空きが無い間は待機する。
+        """
+        num_chunks = math.ceil(total_duration_seconds / chunk_length_seconds)
+        if num_chunks == 0:
+            return
+
+        # 元ファイルのビットレートからチャンクのサイズを見積もる (c:a copy なのでほぼ比例する)
+        bytes_per_second = os.path.getsize(audio_file_path) / total_duration_seconds
+
+        for i in range(num_chunks):
+            start_time_seconds = i * chunk_length_seconds
+            duration_current_chunk = min(chunk_length_seconds, total_duration_seconds - start_time_seconds)
+            if duration_current_chunk <= 0: # 最後のチャンクが既に終わっている場合
+                break
+
+            # -f mp3 pipe:1: チャンクをファイルではなく標準出力に書き出す
+            ffmpeg_command = [
+                'ffmpeg',
+                '-loglevel', 'error',
+                '-i', audio_file_path,
+                '-ss', str(start_time_seconds),
+                '-t', str(duration_current_chunk),
+                '-c:a', 'copy', # 音声ストリームをコピー（再エンコードしない）
+                '-map_chapters', '-1',
+                '-f', 'mp3',
+                'pipe:1'
+            ]
+
+            estimated_bytes = int(bytes_per_second * duration_current_chunk * 1.05) + 64 * 1024
+            chunk_buffer = ChunkBuffer(chunk_memory_budget, estimated_bytes)
+            process = None
+            try:
+                print(f"   ffmpeg でチャンク {i} をメモリ上に作成中: {start_time_seconds}s - {start_time_seconds + duration_current_chunk}s")
+                # 標準エラー出力もパイプにすると、壊れた音声などで大量に出力された場合に
+                # 標準出力の読み込みと互いに待ち合って止まるため、一時ファイルに書き出す
+                with tempfile.TemporaryFile() as error_file:
+                    process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=error_file)
+                    chunk_buffer.fill_from(process.stdout)
+                    process.stdout.close()
+                    return_code = process.wait()
+                    error_file.seek(0)
+                    error_output = error_file.read().decode('utf-8', errors='replace')
+                if return_code != 0 or len(chunk_buffer) == 0:
+                    print(f"警告: ffmpeg でチャンク {i} の作成中にエラーが発生しました (リターンコード {return_code})")
+                    print(f"    コマンド: {' '.join(ffmpeg_command)}")
+                    print(f"    エラー出力 (末尾):\n{error_output[-4000:]}")
+                    # エラーが発生したチャンクはスキップ
+                    chunk_buffer.release()
+                    continue
+            except FileNotFoundError:
+                chunk_buffer.release()
+                print(f"エラー: ffmpeg 実行ファイルが見つかりません。PATHが正しく設定されているか確認してください。")
+                raise # ffmpegがない場合は致命的なエラーとして再raise
+            except BaseException:
+                chunk_buffer.release()
+                if process is not None:
+                    # 読み込みの途中で失敗した場合も ffmpeg を残さず終了させて回収する
+                    process.kill()
+                    process.stdout.close()
+                    process.wait()
+                raise
+
+            yield {"index": i, "name": f"chunk_{i:04d}.mp3", "buffer": chunk_buffer}
+
     def _transcribe_audio_chunk_parallel(self, chunk_info):
         """
         単一の音声チャンクをWhisper APIに送信し、文字起こし結果を返す。
         並行処理のために設計されたヘルパーメソッド。
         """
+        import openai # 例外クラスの参照用 (get_openai_client() の時点でインポート済みのため軽量)
+
         chunk_index = chunk_info["index"]
-        chunk_path = chunk_info["path"]
+        chunk_path = chunk_info.get("path")
+        chunk_buffer = chunk_info.get("buffer") # メモリ上のチャンクの場合 (TRANSCRIPTION_CHUNK_STORAGE = 'memory')
+        chunk_name = os.path.basename(chunk_path) if chunk_path else chunk_info["name"]
 
-        print(f"   チャンク {chunk_index} の文字起こしを開始します ({os.path.basename(chunk_path)})...")
+        print(f"   チャンク {chunk_index} の文字起こしを開始します ({chunk_name})...")
 
         try:
+            openai_client = get_openai_client()
             if openai_client is None:
                 return {"index": chunk_index, "text": "", "error": "OpenAIクライアントが初期化されていません。"}
 
             # ファイルサイズチェック (Whisper APIの制限25MB)
-            file_size_mb = os.path.getsize(chunk_path) / (1024 * 1024)
+            file_size_mb = (len(chunk_buffer) if chunk_buffer is not None else os.path.getsize(chunk_path)) / (1024 * 1024)
             if file_size_mb > 25:
                 # このケースはffmpegのc:a copyでは発生しにくいが、念のため
                 print(f"   警告: チャンク {chunk_index} のファイルサイズが25MBを超えています ({file_size_mb:.2f}MB)。スキップします。")
                 return {"index": chunk_index, "text": "", "error": f"ファイルサイズが25MBを超過 ({file_size_mb:.2f}MB)"}
 
 
-            with open(chunk_path, "rb") as audio_file:
+            # メモリ上のチャンクはコピーせずにそのままアップロードする (Whisperは拡張子で形式を判定するためファイル名も渡す)
+            with (chunk_buffer.open() if chunk_buffer is not None else open(chunk_path, "rb")) as audio_file:
                 transcript = openai_client.audio.transcriptions.create(
                     model="whisper-1",
-                    file=audio_file,
+                    file=(chunk_name, audio_file),
                     language="ja"
                 )
+            report_openai_success()
             print(f"   チャンク {chunk_index} の文字起こしが完了しました。")
             return {"index": chunk_index, "text": transcript.text}
         except openai.APIError as e:
+            report_openai_failure(e)
             print(f"   チャンク {chunk_index} でOpenAI APIエラーが発生しました: {e}")
             return {"index": chunk_index, "text": "", "error": f"OpenAI APIエラー: {e.code} - {e.message}"}
         except Exception as e:
             print(f"   チャンク {chunk_index} の文字起こし中にエラーが発生しました: {e}")
             print(f"トレースバック:\n{traceback.format_exc()}")
-            return {"index": chunk_index, "text": "", "error": str(e)}
\ No newline at end of file
+            return {"index": chunk_index, "text": "", "error": str(e)}
+        finally:
+            if chunk_buffer is not None:
+                # アップロードが終わったらメモリ予算を返却し、次のチャンクの作成を再開させる
+                chunk_buffer.release()
+
+
+class UsageAPI(APIView):
+    """
+    API to return the caller's current quota usage (audio minutes and tokens) and queued tasks.
+    """
+
+    def get(self, request, *args, **kwargs):
+        client_key = get_client_key(request)
+        usage = get_usage(client_key)
+        usage["queued"] = {
+            "transcription": transcription_scheduler.queued_count(client_key),
+            "completion": completion_scheduler.queued_count(client_key),
+        }
+        return Response(usage, status=status.HTTP_200_OK)
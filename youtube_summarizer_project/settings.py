@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'django.middleware.gzip.GZipMiddleware', # Accept-Encoding: gzip のクライアントにはレスポンスを圧縮して返す
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -73,6 +74,15 @@ TEMPLATES = [
     },
 ]
 
+# Django REST framework
+# JSONのシリアライズには orjson を使う (コンパクトな出力で、標準の JSONRenderer より高速)
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'summarizer_app.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
 WSGI_APPLICATION = 'youtube_summarizer_project.wsgi.application'
 
 
@@ -82,7 +92,9 @@ WSGI_APPLICATION = 'youtube_summarizer_project.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'), # 負荷試験などで別のDBを使う場合は SQLITE_PATH で指定
+        # 複数のリクエストが同時に要約を保存しても "database is locked" で失敗せず、ロックの解放を待つようにする (秒)
+        'OPTIONS': {'timeout': float(os.getenv('SQLITE_TIMEOUT_SECONDS', 20))},
     }
 }
 
@@ -140,7 +152,60 @@ GCP_SERVICE_ACCOUNT_KEY_PATH = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
 # 一時ファイルを保存するディレクトリ
 # プロジェクトのルートに 'temp' ディレクトリが作成されます
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-MEDIA_ROOT = os.path.join(BASE_DIR, 'temp')
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(BASE_DIR, 'temp'))
 os.makedirs(MEDIA_ROOT, exist_ok=True) # ディレクトリが存在しない場合は作成
 
-OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', 'YOUR_OPENAI_API_KEY_HERE') 
\ No newline at end of file
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', 'YOUR_OPENAI_API_KEY_HERE') 
+
+# 外部サービスの接続先 (負荷試験ではローカルの代替サービスに向ける。未指定の場合は本番のサービスを使う)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+YOUTUBE_API_ENDPOINT = os.getenv('YOUTUBE_API_ENDPOINT') or None
+YT_DLP_COMMAND = os.getenv('YT_DLP_COMMAND', 'yt-dlp')
+
+# 要約・練習問題プロンプトに埋め込む文字起こしテキストのトークン予算 (モデルごと)
+# 出力トークン (max_tokens) とプロンプト本文の分を差し引いた値にしておく
+TRANSCRIPT_TOKEN_BUDGETS = {
+    'gpt-3.5-turbo': 13000, # コンテキスト長 16K - 出力 1000 - プロンプト本文
+    'gpt-4': 6000, # コンテキスト長 8K - 出力 1500 - プロンプト本文
+}
+TRANSCRIPT_TOKEN_BUDGET_DEFAULT = 3000
+
+# 外部APIクライアントの接続設定 (summarizer_app/clients.py)
+# OpenAI: プロセス内で1つのクライアントを共有し、keep-alive 接続を使い回す (接続数の上限はワーカー数と合わせて下で設定)
+OPENAI_HTTP_KEEPALIVE_EXPIRY_SECONDS = 60
+OPENAI_HTTP_TIMEOUT_SECONDS = 600 # Whisper へのアップロードや長い生成に備えて長めにする
+OPENAI_CLIENT_MAX_CONSECUTIVE_FAILURES = 3 # 接続エラーがこの回数続いたらクライアントを作り直す
+# YouTube Data API: httplib2 はスレッドセーフではないため、クライアントをプールして貸し出す
+YOUTUBE_CLIENT_POOL_SIZE = 4
+YOUTUBE_HTTP_TIMEOUT_SECONDS = 30
+
+# Whisper / GPT の容量の共有 (summarizer_app/scheduling.py, summarizer_app/quotas.py)
+# 全リクエストで共有するワーカー数。クライアント (ユーザー / APIキー / IP) ごとに重み付きで公平に割り当てる
+TRANSCRIPTION_MAX_CONCURRENCY = int(os.getenv('TRANSCRIPTION_MAX_CONCURRENCY', 20))
+COMPLETION_MAX_CONCURRENCY = int(os.getenv('COMPLETION_MAX_CONCURRENCY', 8))
+# OpenAI への接続数は両方のワーカーの合計にして、生成が文字起こしの後ろで接続の空きを待たないようにする
+OPENAI_HTTP_MAX_CONNECTIONS = int(os.getenv('OPENAI_HTTP_MAX_CONNECTIONS', TRANSCRIPTION_MAX_CONCURRENCY + COMPLETION_MAX_CONCURRENCY))
+OPENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS', OPENAI_HTTP_MAX_CONNECTIONS))
+# クライアントごとの重み (例: {'key:<ハッシュ>': 2.0})。重みはプロセス内のスケジューラでのみ比較される
+FAIR_SCHEDULER_DEFAULT_WEIGHT = 1.0
+FAIR_SCHEDULER_WEIGHTS = {}
+# ingest_videos コマンドは別プロセスで独自のスケジューラを持つため、Webのリクエストとは容量を共有しない。
+# 同じ OpenAI のアカウントを使うWebへの影響を抑えるよう、コマンド側の並行数を小さく制限する
+INGEST_TRANSCRIPTION_MAX_CONCURRENCY = int(os.getenv('INGEST_TRANSCRIPTION_MAX_CONCURRENCY', 4))
+INGEST_COMPLETION_MAX_CONCURRENCY = int(os.getenv('INGEST_COMPLETION_MAX_CONCURRENCY', 2))
+# X-API-Key ヘッダーでクライアントを識別する場合の登録済みキー (カンマ区切り)。未登録のキーは接続元IPで識別する
+CLIENT_API_KEYS = frozenset(key.strip() for key in os.getenv('CLIENT_API_KEYS', '').split(',') if key.strip())
+# クライアントごとの時間枠あたりの利用量の上限 (キャッシュに記録する)
+QUOTA_WINDOW_SECONDS = 60 * 60
+QUOTA_AUDIO_MINUTES_PER_WINDOW = int(os.getenv('QUOTA_AUDIO_MINUTES_PER_WINDOW', 240))
+QUOTA_TOKENS_PER_WINDOW = int(os.getenv('QUOTA_TOKENS_PER_WINDOW', 200000))
+
+# YouTube Data API で取得した動画情報のキャッシュ期間 (ETag による再検証で更新の有無を確認する)
+YOUTUBE_METADATA_CACHE_SECONDS = 60 * 60 * 24
+
+# 文字起こし用の音声チャンクの置き場所
+# 'disk': MEDIA_ROOT 以下の一時ファイルに書き出してからアップロードする
+# 'memory': ffmpeg の出力をパイプで受け取り、メモリ上からそのままアップロードする (一時ファイルの書き込み・読み込みが不要)
+TRANSCRIPTION_CHUNK_STORAGE = os.getenv('TRANSCRIPTION_CHUNK_STORAGE', 'disk')
+# 'memory' の場合にプロセス全体でメモリ上に保持するチャンクの合計サイズの上限 (超える場合は次のチャンクの作成を待つ)
+TRANSCRIPTION_MEMORY_BUDGET_BYTES = int(os.getenv('TRANSCRIPTION_MEMORY_BUDGET_BYTES', 256 * 1024 * 1024))